@@ -0,0 +1,34 @@
+"""Leave failed locations out of location counts
+
+Revision ID: 274a2a93668a
+Revises: b17037c1390e
+Create Date: 2026-10-18 09:43:14.021447
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '274a2a93668a'
+down_revision: Union[str, None] = 'b17037c1390e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "UPDATE users SET location_count = location_count - "
+        "(SELECT COUNT(*) FROM locations "
+        "WHERE locations.user_id = users.id AND locations.status = 'failed')"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "UPDATE users SET location_count = location_count + "
+        "(SELECT COUNT(*) FROM locations "
+        "WHERE locations.user_id = users.id AND locations.status = 'failed')"
+    )
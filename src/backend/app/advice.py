@@ -0,0 +1,231 @@
+import math
+from datetime import datetime, timedelta
+from string import Template
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import bindparam, delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models, upstream
+from app.cache import TTLCache
+from app.config import get_settings
+
+# Advice templates keyed by weather bucket, in front of the weather_advice table
+_advice_cache = None
+
+# Times that templates were served from memory, written back to the table in batches
+_pending_touches = {}
+TOUCH_BATCH_SIZE = 64
+
+
+# Define a function to get the advice cache
+def get_advice_cache() -> TTLCache:
+    global _advice_cache
+    if _advice_cache is None:
+        settings = get_settings()
+        _advice_cache = TTLCache(settings.advice_cache_size, settings.advice_cache_ttl)
+    return _advice_cache
+
+
+# Define a function to get the cache key for the given weather conditions
+def advice_key(temperature: float, description: str, locale: Optional[str] = None):
+    step = get_settings().advice_temperature_step
+    bucket = math.floor((temperature - 273.15) / step)
+    return (bucket, description.strip().lower(), locale or "")
+
+
+# Define a function to format the weather sentence given to the AI
+def weather_sentence(city: str, country: str, temperature: float, description: str):
+    location_info = f"{city}, {country}"
+    return f"The weather in {location_info} is currently {temperature - 273.15} degrees Celsius with {description}."
+
+
+# Define a function to turn AI advice into a template for other cities
+#
+# Only the weather sentence the AI was asked to extend is swapped for a
+# placeholder, so city names that are also words, or a city named after its
+# country, are left alone in the rest of the advice. When the AI replied with
+# just its continuation, the sentence is put in front of it.
+def to_template(text: str, weather_info: str) -> str:
+    start = text.find(weather_info)
+    if start < 0:
+        return "${weather} " + text.lstrip().replace("$", "$$")
+    end = start + len(weather_info)
+    return (
+        text[:start].replace("$", "$$") + "${weather}" + text[end:].replace("$", "$$")
+    )
+
+
+# Define a function to fill in a cached advice template
+#
+# Templates stored before the weather sentence had its own placeholder name the
+# city, country and temperature separately.
+def render(
+    template: str, city: str, country: str, temperature: float, description: str
+) -> str:
+    return Template(template).safe_substitute(
+        weather=weather_sentence(city, country, temperature, description),
+        city=city,
+        country=country,
+        temperature=f"{temperature - 273.15}",
+    )
+
+
+# Define a function to build a query for the advice stored under a key
+def _select_advice(key: tuple):
+    bucket, description, locale = key
+    return select(models.WeatherAdvice).where(
+        models.WeatherAdvice.temperature_bucket == bucket,
+        models.WeatherAdvice.description == description,
+        models.WeatherAdvice.locale == locale,
+    )
+
+
+# Define a function to load a stored advice template and its remaining lifetime
+async def _load_template(db: AsyncSession, key: tuple) -> Optional[tuple]:
+    advice = await db.scalar(_select_advice(key))
+    if not advice:
+        return None
+    now = datetime.utcnow()
+    expires = advice.created_at + timedelta(seconds=get_settings().advice_cache_ttl)
+    if expires <= now:
+        return None
+    advice.last_used_at = now
+    await db.commit()
+    return advice.template, (expires - now).total_seconds()
+
+
+# Define a function to record when templates served from memory were last used
+async def _flush_touches(db: AsyncSession):
+    if not _pending_touches:
+        return
+    touches = [
+        {"b": bucket, "d": description, "l": locale, "used": used_at}
+        for (bucket, description, locale), used_at in _pending_touches.items()
+    ]
+    _pending_touches.clear()
+    table = models.WeatherAdvice.__table__
+    await db.execute(
+        table.update()
+        .where(
+            table.c.temperature_bucket == bindparam("b"),
+            table.c.description == bindparam("d"),
+            table.c.locale == bindparam("l"),
+        )
+        .values(last_used_at=bindparam("used")),
+        touches,
+    )
+    await db.commit()
+
+
+# Define a function to store an advice template, evicting the least recently used
+async def _store_template(db: AsyncSession, key: tuple, template: str):
+    bucket, description, locale = key
+    advice = await db.scalar(_select_advice(key))
+    if advice:
+        advice.template = template
+        advice.created_at = advice.last_used_at = datetime.utcnow()
+    else:
+        db.add(
+            models.WeatherAdvice(
+                temperature_bucket=bucket,
+                description=description,
+                locale=locale,
+                template=template,
+            )
+        )
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Another request stored advice for the same conditions first
+        await db.rollback()
+        return
+
+    # Bring last use times up to date so the eviction spares templates hot in memory
+    await _flush_touches(db)
+    overflow = (
+        await db.scalar(select(func.count(models.WeatherAdvice.id)))
+        - get_settings().advice_cache_rows
+    )
+    if overflow > 0:
+        oldest = (
+            select(models.WeatherAdvice.id)
+            .order_by(models.WeatherAdvice.last_used_at)
+            .limit(overflow)
+        )
+        await db.execute(
+            delete(models.WeatherAdvice)
+            .where(models.WeatherAdvice.id.in_(oldest.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+
+# Define a function to get the template for a key from memory or the table
+async def _cached_template(db: AsyncSession, key: tuple) -> Optional[str]:
+    cache = get_advice_cache()
+    template = cache.get(key)
+    if template is None:
+        stored = await _load_template(db, key)
+        if stored is not None:
+            template, ttl = stored
+            cache.set(key, template, ttl=ttl)
+    else:
+        _pending_touches[key] = datetime.utcnow()
+        if len(_pending_touches) >= TOUCH_BATCH_SIZE:
+            await _flush_touches(db)
+    return template
+
+
+# Define a function to remember the AI advice given for some weather conditions
+async def _remember(db: AsyncSession, key: tuple, text: str, weather_info: str):
+    template = to_template(text, weather_info)
+    await _store_template(db, key, template)
+    get_advice_cache().set(key, template)
+
+
+# Define a function to get clothing advice, reusing advice for similar weather
+async def get_weather_advice(
+    db: AsyncSession,
+    city: str,
+    country: str,
+    temperature: float,
+    description: str,
+    locale: Optional[str] = None,
+) -> str:
+    key = advice_key(temperature, description, locale)
+    template = await _cached_template(db, key)
+    if template is not None:
+        return render(template, city, country, temperature, description)
+
+    weather_info = weather_sentence(city, country, temperature, description)
+    text = await upstream.complete_weather_info(weather_info, locale)
+    await _remember(db, key, text, weather_info)
+    return text
+
+
+# Define a function to stream clothing advice as it is written
+#
+# Reused advice arrives as one chunk. New advice is remembered once the AI has
+# finished writing it.
+async def stream_weather_advice(
+    db: AsyncSession,
+    city: str,
+    country: str,
+    temperature: float,
+    description: str,
+    locale: Optional[str] = None,
+) -> AsyncIterator[str]:
+    key = advice_key(temperature, description, locale)
+    template = await _cached_template(db, key)
+    if template is not None:
+        yield render(template, city, country, temperature, description)
+        return
+
+    weather_info = weather_sentence(city, country, temperature, description)
+    chunks = []
+    async for chunk in upstream.stream_weather_info(weather_info, locale):
+        chunks.append(chunk)
+        yield chunk
+    await _remember(db, key, "".join(chunks), weather_info)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+# Define the seconds a busy worker is given to finish its step when stopping
+STOP_GRACE = 10
+
+
+# Define a background worker that repeats a step until it runs out of work
+#
+# The step is given a session factory and returns whether there may be more
+# work. Once there is none the worker sleeps until notified, or until the poll
+# interval passes so work queued by other processes is picked up.
+class Worker:
+    def __init__(
+        self,
+        step: Callable[[async_sessionmaker], Awaitable[bool]],
+        logger: logging.Logger,
+        failure: str,
+    ):
+        self.step = step
+        self.logger = logger
+        self.failure = failure
+        self.stopping = False
+        self._tasks = []
+        self._wakeup = None
+
+    # Define a function to run one task until the worker is stopped
+    async def _work(self, session_factory: async_sessionmaker, poll_interval: float):
+        while not self.stopping:
+            self._wakeup.clear()
+            try:
+                while not self.stopping and await self.step(session_factory):
+                    pass
+            except Exception:
+                self.logger.exception(self.failure)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # Define a function to start the worker's tasks
+    def start(
+        self, session_factory: async_sessionmaker, poll_interval: float, tasks: int = 1
+    ):
+        self._wakeup = asyncio.Event()
+        self.stopping = False
+        for _ in range(tasks):
+            self._tasks.append(
+                asyncio.create_task(self._work(session_factory, poll_interval))
+            )
+
+    # Define a function to wake the worker after giving it work
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # Define a function to stop the worker, leaving unfinished work for the next start
+    #
+    # Tasks finish the step they are on rather than being cancelled at once, as
+    # cancelling one while it opens a database connection leaves the
+    # connection's thread running and the process cannot exit. Tasks still busy
+    # after the grace period are cancelled.
+    async def stop(self):
+        self.stopping = True
+        self.notify()
+        if self._tasks:
+            _, busy = await asyncio.wait(self._tasks, timeout=STOP_GRACE)
+            for task in busy:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._wakeup = None
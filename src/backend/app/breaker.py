@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+# Define an error for calls refused while a circuit is open
+class CircuitOpen(Exception):
+    pass
+
+
+# Define a circuit breaker that fails fast once a service keeps failing
+#
+# After `threshold` failures in a row the circuit opens and calls are refused
+# without touching the service. Once `reset_after` seconds have passed a single
+# trial call is let through: success closes the circuit, failure opens it again.
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int, reset_after: float):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return "open"
+        return "half-open"
+
+    # Define a function to refuse the call while the circuit is open
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "open":
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} is unavailable")
+            if state == "half-open":
+                # Hold the circuit open for everyone else while the trial call runs
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,160 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+# Define a function to read a float setting from the environment
+def _float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+# Define a function to read an integer setting from the environment
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+# Define a function to read a comma-separated list setting from the environment
+def _list(name: str) -> tuple:
+    return tuple(
+        item.strip() for item in os.getenv(name, "").split(",") if item.strip()
+    )
+
+
+# Define the application settings
+@dataclass(frozen=True)
+class Settings:
+    weather_cache_grid: float
+    weather_cache_ttl: float
+    weather_cache_size: int
+    advice_temperature_step: float
+    advice_cache_ttl: float
+    advice_cache_size: int
+    advice_cache_rows: int
+    bcrypt_rounds: int
+    hash_pool_size: int
+    hash_queue_depth: int
+    hash_retry_after: int
+    token_cache_size: int
+    sqlite_journal_mode: str
+    sqlite_synchronous: str
+    sqlite_busy_timeout: int
+    sqlite_mmap_size: int
+    sqlite_cache_size: int
+    sqlite_temp_store: str
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_timeout: float
+    batch_max_size: int
+    batch_concurrency: int
+    export_chunk_size: int
+    rate_limit_storage_uri: str
+    job_workers: int
+    job_max_attempts: int
+    job_retry_delay: float
+    job_lease: float
+    job_poll_interval: float
+    upstream_max_connections: int
+    upstream_max_keepalive: int
+    upstream_keepalive_expiry: float
+    upstream_connect_timeout: float
+    ipdata_timeout: float
+    openweather_timeout: float
+    openai_timeout: float
+    upstream_retries: int
+    upstream_retry_delay: float
+    upstream_retry_max_delay: float
+    breaker_threshold: int
+    breaker_reset_after: float
+    trusted_proxies: tuple
+    geoip_database: Optional[str]
+    geoip_cache_size: int
+    geoip_cache_ttl: float
+    geoip_cache_prefix: int
+    geoip_cache_prefix_v6: int
+    user_cache_size: int
+    user_cache_ttl: float
+    user_cache_version_path: str
+    user_cache_slots: int
+    deletion_chunk_size: int
+    deletion_pause: float
+    deletion_poll_interval: float
+    retention_days: float
+    retention_batch_size: int
+    retention_pause: float
+    retention_interval: float
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            weather_cache_grid=_float("WEATHER_CACHE_GRID", 0.1),
+            weather_cache_ttl=_float("WEATHER_CACHE_TTL", 600),
+            weather_cache_size=_int("WEATHER_CACHE_SIZE", 1024),
+            advice_temperature_step=_float("ADVICE_TEMPERATURE_STEP", 2.0),
+            advice_cache_ttl=_float("ADVICE_CACHE_TTL", 7 * 24 * 60 * 60),
+            advice_cache_size=_int("ADVICE_CACHE_SIZE", 512),
+            advice_cache_rows=_int("ADVICE_CACHE_ROWS", 10000),
+            bcrypt_rounds=_int("BCRYPT_ROUNDS", 12),
+            hash_pool_size=_int("HASH_POOL_SIZE", os.cpu_count() or 1),
+            hash_queue_depth=_int("HASH_QUEUE_DEPTH", 64),
+            hash_retry_after=_int("HASH_RETRY_AFTER", 1),
+            token_cache_size=_int("TOKEN_CACHE_SIZE", 4096),
+            sqlite_journal_mode=os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+            sqlite_synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+            sqlite_busy_timeout=_int("SQLITE_BUSY_TIMEOUT", 5000),
+            sqlite_mmap_size=_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+            sqlite_cache_size=_int("SQLITE_CACHE_SIZE", -64000),
+            sqlite_temp_store=os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+            db_pool_size=_int("DB_POOL_SIZE", 5),
+            db_max_overflow=_int("DB_MAX_OVERFLOW", 10),
+            db_pool_timeout=_float("DB_POOL_TIMEOUT", 30),
+            batch_max_size=_int("BATCH_MAX_SIZE", 50),
+            batch_concurrency=_int("BATCH_CONCURRENCY", 8),
+            export_chunk_size=_int("EXPORT_CHUNK_SIZE", 1000),
+            rate_limit_storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://"),
+            job_workers=_int("JOB_WORKERS", 4),
+            job_max_attempts=_int("JOB_MAX_ATTEMPTS", 3),
+            job_retry_delay=_float("JOB_RETRY_DELAY", 5),
+            job_lease=_float("JOB_LEASE", 120),
+            job_poll_interval=_float("JOB_POLL_INTERVAL", 1),
+            upstream_max_connections=_int("UPSTREAM_MAX_CONNECTIONS", 100),
+            upstream_max_keepalive=_int("UPSTREAM_MAX_KEEPALIVE", 20),
+            upstream_keepalive_expiry=_float("UPSTREAM_KEEPALIVE_EXPIRY", 30),
+            upstream_connect_timeout=_float("UPSTREAM_CONNECT_TIMEOUT", 3),
+            ipdata_timeout=_float("IPDATA_TIMEOUT", 5),
+            openweather_timeout=_float("OPENWEATHER_TIMEOUT", 5),
+            openai_timeout=_float("OPENAI_TIMEOUT", 30),
+            upstream_retries=_int("UPSTREAM_RETRIES", 2),
+            upstream_retry_delay=_float("UPSTREAM_RETRY_DELAY", 0.2),
+            upstream_retry_max_delay=_float("UPSTREAM_RETRY_MAX_DELAY", 2),
+            breaker_threshold=_int("BREAKER_THRESHOLD", 5),
+            breaker_reset_after=_float("BREAKER_RESET_AFTER", 30),
+            trusted_proxies=_list("TRUSTED_PROXIES"),
+            geoip_database=os.getenv("GEOIP_DATABASE"),
+            geoip_cache_size=_int("GEOIP_CACHE_SIZE", 4096),
+            geoip_cache_ttl=_float("GEOIP_CACHE_TTL", 24 * 60 * 60),
+            geoip_cache_prefix=_int("GEOIP_CACHE_PREFIX", 24),
+            geoip_cache_prefix_v6=_int("GEOIP_CACHE_PREFIX_V6", 64),
+            user_cache_size=_int("USER_CACHE_SIZE", 10000),
+            user_cache_ttl=_float("USER_CACHE_TTL", 300),
+            user_cache_version_path=os.getenv(
+                "USER_CACHE_VERSION_PATH", "./user_versions.bin"
+            ),
+            user_cache_slots=_int("USER_CACHE_SLOTS", 16384),
+            deletion_chunk_size=_int("DELETION_CHUNK_SIZE", 500),
+            deletion_pause=_float("DELETION_PAUSE", 0.05),
+            deletion_poll_interval=_float("DELETION_POLL_INTERVAL", 30),
+            retention_days=_float("RETENTION_DAYS", 90),
+            retention_batch_size=_int("RETENTION_BATCH_SIZE", 1000),
+            retention_pause=_float("RETENTION_PAUSE", 0.05),
+            retention_interval=_float("RETENTION_INTERVAL", 60 * 60),
+        )
+
+
+# Define a function to get the application settings, loading env files the first time
+@lru_cache
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings.from_env()
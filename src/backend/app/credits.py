@@ -0,0 +1,41 @@
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models, users
+
+# Define the cost for adding a location
+LOCATION_COST = 400
+
+
+# Define a function to take credits from a user if they can afford them
+async def reserve_credits(db: AsyncSession, user_id: int, amount: int) -> bool:
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.credits >= amount)
+        .values(credits=models.User.credits - amount)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    if result.rowcount == 1:
+        users.invalidate(user_id)
+    return result.rowcount == 1
+
+
+# Define a function to give credits to a user
+async def add_credits(db: AsyncSession, user_id: int, amount: int) -> bool:
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(credits=models.User.credits + amount)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    if result.rowcount == 1:
+        users.invalidate(user_id)
+    return result.rowcount == 1
+
+
+# Define a function to return reserved credits after a failed request
+async def refund_credits(db: AsyncSession, user_id: int, amount: int):
+    await db.rollback()
+    await add_credits(db, user_id, amount)
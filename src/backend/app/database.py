@@ -1,11 +1,59 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.config import get_settings
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./weather.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./weather.db"
+
+
+# Define a function to apply the SQLite storage profile to a new connection
+def apply_storage_profile(dbapi_connection, connection_record):
+    settings = get_settings()
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout:d}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size:d}")
+    cursor.execute(f"PRAGMA cache_size={settings.sqlite_cache_size:d}")
+    cursor.execute(f"PRAGMA temp_store={settings.sqlite_temp_store}")
+    # Enforce foreign keys, so removing a user cascades to their locations
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+# Define a function to get the pool sizing for the engines
+def pool_options() -> dict:
+    settings = get_settings()
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+    }
 
+
+# Synchronous engine, used by Alembic, scripts and table creation
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    **pool_options(),
 )
+event.listen(engine, "connect", apply_storage_profile)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asynchronous engine, used by the routes
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=AsyncAdaptedQueuePool,
+    **pool_options(),
+)
+event.listen(async_engine.sync_engine, "connect", apply_storage_profile)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
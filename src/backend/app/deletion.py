@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import background, models, users
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+# Define a function to mark a user deleted, returning whether they existed
+#
+# The user can no longer sign in or use their tokens from this point on. Their
+# rows are removed later by the purge, so deleting a long history does not
+# hold the database's write lock while other requests wait.
+async def tombstone(db: AsyncSession, user_id: int) -> bool:
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    if result.rowcount != 1:
+        return False
+    users.invalidate(user_id)
+    return True
+
+
+# Define a function to find the deleted user waiting longest to be purged
+async def _next_deleted(db: AsyncSession) -> Optional[int]:
+    return await db.scalar(
+        select(models.User.id)
+        .where(models.User.deleted_at.isnot(None))
+        .order_by(models.User.deleted_at)
+        .limit(1)
+    )
+
+
+# Define a function to delete one chunk of a user's locations, returning whether it was full
+async def _delete_chunk(db: AsyncSession, user_id: int, chunk_size: int) -> bool:
+    chunk = (
+        select(models.Location.id)
+        .where(models.Location.user_id == user_id)
+        .limit(chunk_size)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        delete(models.Location)
+        .where(models.Location.id.in_(chunk))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == chunk_size
+
+
+# Define a function to purge a deleted user, returning whether they are gone
+#
+# Each chunk is its own short transaction, with a pause between chunks so
+# other writers get the lock. Removing the user row itself cascades to any
+# locations saved by requests that were already running when it was deleted.
+async def purge(db: AsyncSession, user_id: int) -> bool:
+    settings = get_settings()
+    while await _delete_chunk(db, user_id, settings.deletion_chunk_size):
+        if _worker.stopping:
+            return False
+        await asyncio.sleep(settings.deletion_pause)
+
+    await db.execute(
+        delete(models.User)
+        .where(models.User.id == user_id, models.User.deleted_at.isnot(None))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    users.invalidate(user_id)
+    return True
+
+
+# Define a function to purge the next deleted user, returning whether there was one
+async def run_once(session_factory: async_sessionmaker) -> bool:
+    async with session_factory() as db:
+        user_id = await _next_deleted(db)
+        if user_id is None:
+            return False
+        return await purge(db, user_id)
+
+
+# Worker purging deleted accounts
+_worker = background.Worker(run_once, logger, "Account purge failed")
+
+
+# Define a function to start the purge
+def start(session_factory: async_sessionmaker):
+    _worker.start(session_factory, get_settings().deletion_poll_interval)
+
+
+# Define a function to wake the purge after deleting an account
+def notify():
+    _worker.notify()
+
+
+# Define a function to stop the purge, leaving the rest of an account for the next start
+async def stop():
+    await _worker.stop()
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import models
+from app.config import get_settings
+
+# Define the columns written for each exported location
+EXPORT_COLUMNS = [
+    "id",
+    "city",
+    "country",
+    "latitude",
+    "longitude",
+    "temperature",
+    "description",
+    "timestamp",
+]
+
+# Define the media type of each export format
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+# Define a function to build the query for a user's locations in export order
+def export_query(user_id: int, since: Optional[datetime] = None):
+    table = models.Location.__table__
+    query = (
+        select(*(table.c[name] for name in EXPORT_COLUMNS))
+        .where(table.c.user_id == user_id)
+        .order_by(table.c.timestamp, table.c.id)
+    )
+    if since is not None:
+        query = query.where(table.c.timestamp > since)
+    return query
+
+
+# Define a function to turn a row into plain values
+def _values(row) -> dict:
+    values = dict(row._mapping)
+    if values["timestamp"] is not None:
+        values["timestamp"] = values["timestamp"].isoformat()
+    return values
+
+
+# Define a function to format a chunk of rows as NDJSON
+def _ndjson_chunk(rows) -> str:
+    return "".join(json.dumps(_values(row)) + "\n" for row in rows)
+
+
+# Define a function to format a chunk of rows as CSV
+def _csv_chunk(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if header:
+        writer.writeheader()
+    writer.writerows(_values(row) for row in rows)
+    return buffer.getvalue()
+
+
+# Define a function to stream a user's locations a chunk at a time
+#
+# The session is opened here rather than taken from a dependency, because
+# dependencies are closed before a streaming response body is sent.
+async def stream_locations(
+    session_factory: async_sessionmaker,
+    user_id: int,
+    format: str,
+    since: Optional[datetime] = None,
+):
+    chunk_size = get_settings().export_chunk_size
+    if format == "csv":
+        yield _csv_chunk([], header=True)
+    async with session_factory() as db:
+        result = await db.stream(
+            export_query(user_id, since).execution_options(yield_per=chunk_size)
+        )
+        async for rows in result.partitions():
+            yield _csv_chunk(rows) if format == "csv" else _ndjson_chunk(rows)
@@ -0,0 +1,128 @@
+import ipaddress
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Request
+
+from app import upstream
+from app.cache import TTLCache
+from app.config import get_settings
+
+# Geolocations keyed by client network, and the offline database, opened on first use
+_location_cache = None
+_reader = None
+
+
+# Define a function to parse an address, returning None if it is not one
+def _parse(address: str) -> Optional[ipaddress._BaseAddress]:
+    try:
+        return ipaddress.ip_address(address.strip())
+    except ValueError:
+        return None
+
+
+# Define a function to get the networks of the proxies trusted to report client addresses
+@lru_cache
+def _trusted_networks(proxies: tuple) -> tuple:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+# Define a function to check whether an address belongs to a trusted proxy
+def _trusted(address: Optional[ipaddress._BaseAddress], networks: tuple) -> bool:
+    return address is not None and any(address in network for network in networks)
+
+
+# Define a function to get the address of the client behind any trusted proxies
+#
+# X-Forwarded-For is only believed when the request came from a trusted proxy.
+# It is read from the right, skipping further trusted proxies, so clients cannot
+# choose their own address by sending the header themselves.
+def client_ip(request: Request) -> Optional[str]:
+    networks = _trusted_networks(get_settings().trusted_proxies)
+    address = _parse(request.client.host) if request.client else None
+    if _trusted(address, networks):
+        forwarded = ",".join(request.headers.getlist("x-forwarded-for"))
+        for entry in reversed(forwarded.split(",")):
+            hop = _parse(entry)
+            if hop is None:
+                break
+            address = hop
+            if not _trusted(hop, networks):
+                break
+    return None if address is None else str(address)
+
+
+# Define a function to get the geolocation cache
+def get_location_cache() -> TTLCache:
+    global _location_cache
+    if _location_cache is None:
+        settings = get_settings()
+        _location_cache = TTLCache(settings.geoip_cache_size, settings.geoip_cache_ttl)
+    return _location_cache
+
+
+# Define a function to get the network whose clients share a cached geolocation
+def location_cache_key(ip: Optional[str]) -> Optional[ipaddress._BaseNetwork]:
+    if ip is None:
+        return None
+    settings = get_settings()
+    address = ipaddress.ip_address(ip)
+    prefix = (
+        settings.geoip_cache_prefix
+        if address.version == 4
+        else settings.geoip_cache_prefix_v6
+    )
+    return ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+
+
+# Define a function to get the offline geolocation database, if one is configured
+def get_reader():
+    global _reader
+    path = get_settings().geoip_database
+    if _reader is None and path:
+        # Installed with the geoip extra, so only imported when a database is set
+        import maxminddb
+
+        _reader = maxminddb.open_database(path)
+    return _reader
+
+
+# Define a function to close the offline geolocation database
+def close_reader():
+    global _reader
+    if _reader is not None:
+        _reader.close()
+    _reader = None
+
+
+# Define a function to look an address up in the offline database
+def lookup_offline(ip: Optional[str]) -> Optional[dict]:
+    reader = get_reader()
+    if reader is None or ip is None:
+        return None
+    record = reader.get(ip)
+    try:
+        return {
+            "latitude": record["location"]["latitude"],
+            "longitude": record["location"]["longitude"],
+            "city": record["city"]["names"]["en"],
+            "country": record["country"]["names"]["en"],
+        }
+    except (KeyError, TypeError):
+        return None
+
+
+# Define a function to geolocate a client, from the cache, the offline database or ipdata
+#
+# Private and loopback addresses cannot be geolocated, so clients on the local
+# network are located by the server's own public address, as ipdata sees it.
+async def locate(ip: Optional[str]) -> dict:
+    if ip is not None and not ipaddress.ip_address(ip).is_global:
+        ip = None
+    key = location_cache_key(ip)
+    cache = get_location_cache()
+    location = cache.get(key)
+    if location is None:
+        location = lookup_offline(ip) or await upstream.lookup_location(ip)
+        cache.set(key, location)
+    return location
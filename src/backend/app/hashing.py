@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+from app import metrics
+from app.config import get_settings
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+# Pool of worker processes for bcrypt, and the number of jobs it currently holds
+_executor = None
+_in_flight = 0
+
+
+# Define an error for when the hashing pool has no room for another job
+class HashingPoolBusy(Exception):
+    pass
+
+
+# Define a function to get the bcrypt context for the given cost
+#
+# Only the worker processes hash passwords, so passlib is imported there.
+@lru_cache
+def _bcrypt_context(rounds: int) -> "CryptContext":
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+# Define the functions run inside the worker processes
+def _hash(password: str, rounds: int) -> str:
+    return _bcrypt_context(rounds).hash(password)
+
+
+def _verify(password: str, hashed_password: str, rounds: int) -> bool:
+    return _bcrypt_context(rounds).verify(password, hashed_password)
+
+
+# Define a function to get the hashing pool
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=get_settings().hash_pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+# Define a function to shut down the hashing pool
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+    _executor = None
+
+
+# Define a function to run a job in the hashing pool, refusing it when the queue is full
+async def _submit(function, *args):
+    global _in_flight
+    settings = get_settings()
+    if _in_flight >= settings.hash_pool_size + settings.hash_queue_depth:
+        raise HashingPoolBusy()
+
+    _in_flight += 1
+    metrics.PASSWORD_HASH_IN_FLIGHT.set(_in_flight)
+    try:
+        loop = asyncio.get_running_loop()
+        with metrics.timer(
+            metrics.PASSWORD_HASH_DURATION, operation=function.__name__.lstrip("_")
+        ):
+            return await loop.run_in_executor(
+                get_executor(), function, *args, settings.bcrypt_rounds
+            )
+    finally:
+        _in_flight -= 1
+        metrics.PASSWORD_HASH_IN_FLIGHT.set(_in_flight)
+
+
+# Define a function to hash a password
+async def hash_password(password: str) -> str:
+    return await _submit(_hash, password)
+
+
+# Define a function to verify a password against its hash
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _submit(_verify, password, hashed_password)
+
+
+# Define a handler telling clients to back off while the hashing pool is full
+def hashing_pool_busy_handler(request: Request, exc: HashingPoolBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry."},
+        headers={"Retry-After": str(get_settings().hash_retry_after)},
+    )
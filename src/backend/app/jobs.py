@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import (
+    advice,
+    background,
+    credits,
+    geolocation,
+    models,
+    stats,
+    upstream,
+    users,
+)
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+# Define a function to queue a location for the workers to fill in
+#
+# The client's address is kept until the location is filled in, so the workers
+# geolocate the client rather than the server.
+def queue_location(
+    user_id: int, locale: Optional[str], client_ip: Optional[str] = None
+) -> models.Location:
+    return models.Location(
+        user_id=user_id,
+        locale=locale,
+        client_ip=client_ip,
+        status="pending",
+        available_at=datetime.utcnow(),
+    )
+
+
+# Define a function to claim the next location that is due, or one whose worker died
+#
+# Pending locations are due once their retry delay has passed. Running ones
+# become due again when their worker's lease runs out, so a crashed worker's
+# location is picked up by another process.
+async def _claim(db: AsyncSession) -> Optional[tuple]:
+    now = datetime.utcnow()
+    due = (
+        select(models.Location.id)
+        .where(
+            models.Location.status.in_(("pending", "running")),
+            models.Location.available_at <= now,
+        )
+        .order_by(models.Location.available_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(models.Location)
+        .where(models.Location.id == due)
+        .values(
+            status="running",
+            attempts=models.Location.attempts + 1,
+            available_at=now + timedelta(seconds=get_settings().job_lease),
+        )
+        .returning(
+            models.Location.id,
+            models.Location.user_id,
+            models.Location.locale,
+            models.Location.client_ip,
+            models.Location.attempts,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    job = result.first()
+    await db.commit()
+    return job
+
+
+# Define a function to build the filter matching a location this worker still holds
+#
+# A worker whose lease ran out may still be running after another one claimed
+# the location again, so it must not write over the newer attempt.
+def _held(location_id: int, attempts: int):
+    return (
+        models.Location.id == location_id,
+        models.Location.status == "running",
+        models.Location.attempts == attempts,
+    )
+
+
+# Define a function to fill in a claimed location with its weather and advice
+async def _fill_in(
+    db: AsyncSession,
+    location_id: int,
+    user_id: int,
+    locale: Optional[str],
+    client_ip: Optional[str],
+    attempts: int,
+):
+    location = await geolocation.locate(client_ip)
+    weather = await upstream.get_weather(location["latitude"], location["longitude"])
+    weather_info = await advice.get_weather_advice(
+        db,
+        location["city"],
+        location["country"],
+        weather["temperature"],
+        weather["description"],
+        locale,
+    )
+    filled_in = (
+        await db.execute(
+            update(models.Location)
+            .where(*_held(location_id, attempts))
+            .values(
+                city=location["city"],
+                country=location["country"],
+                latitude=location["latitude"],
+                longitude=location["longitude"],
+                temperature=weather["temperature"],
+                description=weather_info,
+                status="ready",
+                available_at=None,
+                client_ip=None,
+            )
+            .returning(models.Location.timestamp)
+            .execution_options(synchronize_session=False)
+        )
+    ).first()
+    if filled_in is not None:
+        await stats.record(
+            db,
+            [
+                {
+                    "user_id": user_id,
+                    "city": location["city"],
+                    "country": location["country"],
+                    "temperature": weather["temperature"],
+                    "timestamp": filled_in.timestamp,
+                }
+            ],
+        )
+    await db.commit()
+
+
+# Define a function to retry a failed location later, or give up and refund it
+#
+# Locations that are given up on are kept so their job can report the failure,
+# but no longer count towards the user's locations.
+async def _fail(db: AsyncSession, location_id: int, user_id: int, attempts: int):
+    await db.rollback()
+    settings = get_settings()
+    if attempts < settings.job_max_attempts:
+        delay = settings.job_retry_delay * 2 ** (attempts - 1)
+        values = {
+            "status": "pending",
+            "available_at": datetime.utcnow() + timedelta(seconds=delay),
+        }
+    else:
+        values = {"status": "failed", "available_at": None, "client_ip": None}
+    failed = (
+        await db.execute(
+            update(models.Location)
+            .where(*_held(location_id, attempts))
+            .values(**values)
+            .returning(models.Location.status)
+            .execution_options(synchronize_session=False)
+        )
+    ).scalar()
+    if failed == "failed":
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(location_count=models.User.location_count - 1)
+        )
+    await db.commit()
+    if failed == "failed":
+        users.invalidate(user_id)
+        await credits.add_credits(db, user_id, credits.LOCATION_COST)
+
+
+# Define a function to claim and fill in one location, returning whether there was one
+async def run_once(session_factory: async_sessionmaker) -> bool:
+    async with session_factory() as db:
+        job = await _claim(db)
+        if job is None:
+            return False
+        location_id, user_id, locale, client_ip, attempts = job
+        try:
+            await _fill_in(db, location_id, user_id, locale, client_ip, attempts)
+        except Exception:
+            logger.warning("Location %s failed attempt %s", location_id, attempts)
+            await asyncio.shield(_fail(db, location_id, user_id, attempts))
+    return True
+
+
+# Workers filling in queued locations
+_workers = background.Worker(run_once, logger, "Location job worker failed")
+
+
+# Define a function to start the workers
+def start(session_factory: async_sessionmaker):
+    settings = get_settings()
+    _workers.start(session_factory, settings.job_poll_interval, settings.job_workers)
+
+
+# Define a function to wake the workers after queueing a location
+def notify():
+    _workers.notify()
+
+
+# Define a function to stop the workers, leaving unfinished locations for the next start
+#
+# Locations of workers cancelled after the grace period are retried once the
+# lease runs out.
+async def stop():
+    await _workers.stop()
@@ -1,18 +1,44 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import _rate_limit_exceeded_handler
+from fastapi.responses import ORJSONResponse
 from slowapi.errors import RateLimitExceeded
 
-from app.database import Base, engine
+from app import deletion, geolocation, hashing, jobs, metrics, retention, upstream
+from app.database import AsyncSessionLocal, Base, async_engine, engine
 from app.routes import limiter
 from app.routes import router as api_router
 
-Base.metadata.create_all(bind=engine)
+# Time every database statement
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+
+
+# Define the application lifespan
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    jobs.start(AsyncSessionLocal)
+    deletion.start(AsyncSessionLocal)
+    retention.start(AsyncSessionLocal)
+    yield
+    await retention.stop()
+    await deletion.stop()
+    await jobs.stop()
+    await upstream.close_clients()
+    geolocation.close_reader()
+    hashing.shutdown()
+    await async_engine.dispose()
+
 
 app = FastAPI(
     title="Weather API",
     version="2.2.0",
     description="An API to receive weather information and present it to the user with AI input.",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -23,7 +49,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_exception_handler(RateLimitExceeded, metrics.rate_limit_exceeded_handler)
+app.add_exception_handler(hashing.HashingPoolBusy, hashing.hashing_pool_busy_handler)
 
 app.include_router(api_router)
+app.include_router(metrics.router)
@@ -0,0 +1,327 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import anyio.to_thread
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from sqlalchemy import event
+
+# Every metric, in the order it is written out
+_registry = []
+
+# Functions sampling other modules' gauges at scrape time
+_collectors = []
+
+# Define the default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Define the content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Define a function to escape a label value
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Define a function to format a set of labels
+def _format_labels(names: tuple, values: tuple, **extra) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Define the shared behaviour of all metrics
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    # Define a function to get the key for the given label values
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    # Define a function to get the current value for the given labels
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    # Define a function to forget every recorded value
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    # Define a function to write the metric in the Prometheus text format
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+# Define a metric that only goes up
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# Define a metric that is set to its current value
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+# Define a metric that counts observations into cumulative buckets
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.setdefault(
+                key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][i] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    def get(self, **labels):
+        with self._lock:
+            sample = self._values.get(self._key(labels))
+            return (
+                None
+                if sample is None
+                else dict(sample, buckets=list(sample["buckets"]))
+            )
+
+    def _samples(self, key: tuple, value) -> list:
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labelnames, key, le=bound)} {count}"
+            for bound, count in zip(self.buckets, value["buckets"])
+        ]
+        lines.append(
+            f"{self.name}_bucket{_format_labels(self.labelnames, key, le='+Inf')} {value['count']}"
+        )
+        lines.append(
+            f"{self.name}_sum{_format_labels(self.labelnames, key)} {value['sum']}"
+        )
+        lines.append(
+            f"{self.name}_count{_format_labels(self.labelnames, key)} {value['count']}"
+        )
+        return lines
+
+
+# Define the application metrics
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to answer HTTP requests.",
+    ("method", "route", "status"),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time taken by database statements.",
+    ("operation", "outcome"),
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Time taken by calls to upstream services.",
+    ("service", "outcome"),
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Time taken to hash or verify a password, including time queued for a worker.",
+    ("operation",),
+)
+PASSWORD_HASH_IN_FLIGHT = Gauge(
+    "password_hash_in_flight",
+    "Password jobs running in or queued for the hashing pool.",
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests refused for exceeding a rate limit.",
+    ("route",),
+)
+THREADPOOL_THREADS = Gauge(
+    "threadpool_threads",
+    "Worker threads of the threadpool running sync code.",
+    ("state",),
+)
+THREADPOOL_QUEUE_DEPTH = Gauge(
+    "threadpool_queue_depth",
+    "Tasks waiting for a free threadpool worker.",
+)
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total",
+    "Calls to upstream services retried after a failure.",
+    ("service",),
+)
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state of each upstream service: 0 closed, 1 half-open, 2 open.",
+    ("service",),
+)
+UPSTREAM_POOL_CONNECTIONS = Gauge(
+    "upstream_pool_connections",
+    "Connections held by the shared upstream HTTP client.",
+    ("state",),
+)
+
+
+# Define a function to time a block of code into a histogram
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        if "outcome" in histogram.labelnames:
+            labels["outcome"] = outcome
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+# Define a function to get the route template a request was matched to
+def route_path(scope: dict) -> str:
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is not None and app is not None:
+        for route in app.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+    return "unmatched"
+
+
+# Define middleware to time every request by route
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route_path(scope),
+                status=status,
+            )
+
+
+# Define a function to time every statement run through an engine
+#
+# A statement that raises never reaches after_cursor_execute, so its start time
+# is taken off the connection's stack when the error is handled instead.
+def instrument_engine(engine):
+    def observe(conn, outcome: str):
+        statement, start = conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        DB_QUERY_DURATION.observe(
+            time.perf_counter() - start, operation=operation, outcome=outcome
+        )
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append((statement, time.perf_counter()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        observe(conn, "ok")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Errors raised before the statement reached the database were never timed
+        conn = context.connection
+        started = conn.info.get("query_start") if conn is not None else None
+        if started and started[-1][0] == context.statement:
+            observe(conn, "error")
+
+
+# Define a handler counting rate limit rejections before refusing the request
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    RATE_LIMIT_REJECTIONS.inc(route=route_path(request.scope))
+    return _rate_limit_exceeded_handler(request, exc)
+
+
+# Define a function to register a function sampling gauges at scrape time
+def add_collector(collector):
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+# Define a function to sample the gauges read at scrape time
+def _sample_runtime():
+    statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+    THREADPOOL_THREADS.set(statistics.borrowed_tokens, state="busy")
+    THREADPOOL_THREADS.set(statistics.total_tokens, state="total")
+    THREADPOOL_QUEUE_DEPTH.set(statistics.tasks_waiting)
+    for collector in _collectors:
+        collector()
+
+
+# Define a function to write every metric in the Prometheus text format
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter()
+
+
+# Define the route to expose the metrics to Prometheus
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    _sample_runtime()
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
@@ -1,6 +1,15 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy_utils import EmailType
 
@@ -15,8 +24,18 @@ class User(Base):
     email = Column(EmailType, unique=True, index=True)
     credits = Column(Integer, default=2000)
     hashed_password = Column(String)
+    location_count = Column(Integer, nullable=False, default=0, server_default="0")
+    deleted_at = Column(DateTime)
 
-    locations = relationship("Location", back_populates="user")
+    locations = relationship("Location", back_populates="user", passive_deletes=True)
+
+
+# Let the purge find deleted accounts without scanning the live ones
+Index(
+    "ix_users_deleted_at",
+    User.deleted_at,
+    sqlite_where=User.deleted_at.isnot(None),
+)
 
 
 class Location(Base):
@@ -29,7 +48,99 @@ class Location(Base):
     description = Column(String)
     latitude = Column(Float)
     longitude = Column(Float)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     timestamp = Column(DateTime, default=datetime.utcnow)
+    status = Column(String, nullable=False, default="ready", server_default="ready")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    locale = Column(String)
+    client_ip = Column(String)
+    available_at = Column(DateTime)
 
     user = relationship("User", back_populates="locations")
+
+
+# Serve each user's history newest first without scanning their older rows
+Index(
+    "ix_locations_user_id_timestamp",
+    Location.user_id,
+    Location.timestamp.desc(),
+    Location.id,
+)
+
+# Let job workers find the next location waiting to be filled in
+Index("ix_locations_status_available_at", Location.status, Location.available_at)
+
+# Let the compactor find locations older than the retention horizon
+Index("ix_locations_timestamp", Location.timestamp)
+
+
+class LocationRollup(Base):
+    __tablename__ = "location_rollups"
+    __table_args__ = (
+        Index(
+            "ix_location_rollups_key",
+            "user_id",
+            "day",
+            "city",
+            "country",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    day = Column(Date, nullable=False)
+    city = Column(String, nullable=False, default="")
+    country = Column(String, nullable=False, default="")
+    min_temperature = Column(Float)
+    max_temperature = Column(Float)
+    avg_temperature = Column(Float)
+    samples = Column(Integer, nullable=False, default=0)
+
+
+class LocationStat(Base):
+    __tablename__ = "location_stats"
+    __table_args__ = (
+        Index(
+            "ix_location_stats_key",
+            "user_id",
+            "city",
+            "country",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    city = Column(String, nullable=False, default="")
+    country = Column(String, nullable=False, default="")
+    samples = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0)
+    min_temperature = Column(Float)
+    max_temperature = Column(Float)
+    last_seen = Column(DateTime)
+
+
+class WeatherAdvice(Base):
+    __tablename__ = "weather_advice"
+    __table_args__ = (
+        Index(
+            "ix_weather_advice_key",
+            "temperature_bucket",
+            "description",
+            "locale",
+            unique=True,
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    temperature_bucket = Column(Integer, nullable=False)
+    description = Column(String, nullable=False)
+    locale = Column(String, nullable=False, default="")
+    template = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, or_
+
+from app import models
+
+
+# Define an error for cursors that cannot be decoded
+class InvalidCursor(ValueError):
+    pass
+
+
+# Define a function to encode the position of a location or location row as a cursor
+def encode_cursor(location) -> str:
+    timestamp = location.timestamp.isoformat() if location.timestamp else None
+    raw = json.dumps([timestamp, location.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# Define a function to decode a cursor into a timestamp and location id
+def decode_cursor(cursor: str) -> tuple[Optional[datetime], int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, location_id = json.loads(raw)
+        if timestamp is not None:
+            timestamp = datetime.fromisoformat(timestamp)
+        if not isinstance(location_id, int):
+            raise TypeError(location_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+    return timestamp, location_id
+
+
+# Define a function to build the filter for locations listed after a cursor
+#
+# Locations are ordered by timestamp descending and then id ascending, which
+# matches ix_locations_user_id_timestamp. Rows saved before timestamps were
+# recorded have none and sort after every dated row, so they always follow
+# a dated cursor.
+def after_cursor(cursor: str):
+    timestamp, location_id = decode_cursor(cursor)
+    if timestamp is None:
+        return and_(
+            models.Location.timestamp.is_(None), models.Location.id > location_id
+        )
+    return or_(
+        and_(
+            models.Location.timestamp <= timestamp,
+            or_(
+                models.Location.timestamp < timestamp,
+                models.Location.id > location_id,
+            ),
+        ),
+        models.Location.timestamp.is_(None),
+    )
@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+import time
+
+import anyio.to_thread
+from limits.storage import MemoryStorage, Storage
+from slowapi import Limiter as BaseLimiter
+from starlette.requests import Request
+
+# Define the number of counter updates between sweeps of expired windows
+PURGE_INTERVAL = 1000
+
+
+# Define a rate limit storage shared by every worker through a local SQLite file
+#
+# Each hit is a single upsert that resets or increments the window and returns
+# the new count, so workers never read and then write a counter and no lock is
+# held between statements. Registered with limits for sqlite:/// URIs.
+class SQLiteStorage(Storage):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri[len("sqlite:///") :]
+        self.timeout = float(options.get("timeout", 5.0))
+        self._local = threading.local()
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # Define a function to get this thread's connection to the counter file
+    #
+    # The file is opened on the first hit rather than when the limiter is
+    # created, so importing the routes does not touch the disk.
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._local.connection = connection
+            self._local.updates = 0
+        return connection
+
+    def incr(
+        self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1
+    ) -> int:
+        now = time.time()
+        connection = self._connection()
+        (count,) = connection.execute(
+            "INSERT INTO rate_limits (key, count, expiry) VALUES (?1, ?2, ?3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expiry <= ?4 THEN ?2 ELSE count + ?2 END, "
+            "expiry = CASE WHEN expiry <= ?4 OR ?5 THEN ?3 ELSE expiry END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, elastic_expiry),
+        ).fetchone()
+
+        # Drop windows that have run out now and then, so the table stays small
+        self._local.updates += 1
+        if self._local.updates >= PURGE_INTERVAL:
+            self._local.updates = 0
+            connection.execute("DELETE FROM rate_limits WHERE expiry <= ?", (now,))
+        return count
+
+    def get(self, key: str) -> int:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT count FROM rate_limits WHERE key = ? AND expiry > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> int:
+        row = (
+            self._connection()
+            .execute("SELECT expiry FROM rate_limits WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return int(row[0] if row else time.time())
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def reset(self) -> int:
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+# Define a rate limiter that checks limits off the event loop
+#
+# slowapi checks a route's limits synchronously before calling it, so with a
+# SQLite file or Redis behind it every request would wait on the event loop for
+# the counter write. Async routes have their limits checked in a worker thread
+# instead and slowapi is told they have been checked. Counters kept in memory
+# are cheap to update and not safe to share between threads, so they are still
+# checked inline.
+class Limiter(BaseLimiter):
+    def limit(self, *args, **kwargs):
+        limit_decorator = super().limit(*args, **kwargs)
+
+        def decorator(func):
+            limited = limit_decorator(func)
+            if not asyncio.iscoroutinefunction(func):
+                return limited
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.get("request")
+                if (
+                    self.enabled
+                    and isinstance(request, Request)
+                    and not isinstance(self._storage, MemoryStorage)
+                    and not getattr(request.state, "_rate_limiting_complete", False)
+                ):
+                    await anyio.to_thread.run_sync(
+                        self._check_request_limit, request, func, False
+                    )
+                    request.state._rate_limiting_complete = True
+                return await limited(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
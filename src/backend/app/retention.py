@@ -0,0 +1,241 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import (
+    Date,
+    Select,
+    bindparam,
+    delete,
+    desc,
+    func,
+    select,
+    type_coerce,
+    union_all,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import background, models, users
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+# Define a function to fold rows into rollups keyed by user, day, city and country
+def _fold(rows) -> dict:
+    rollups = {}
+    for row in rows:
+        if row.status != "ready" or row.temperature is None:
+            continue
+        key = (row.user_id, row.timestamp.date(), row.city or "", row.country or "")
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollups[key] = [row.temperature, row.temperature, row.temperature, 1]
+        else:
+            rollup[0] = min(rollup[0], row.temperature)
+            rollup[1] = max(rollup[1], row.temperature)
+            rollup[2] += row.temperature
+            rollup[3] += 1
+    return rollups
+
+
+# Define a function to add folded rows to the stored rollups
+async def _merge_rollups(db: AsyncSession, rollups: dict):
+    statement = insert(models.LocationRollup)
+    new = statement.excluded
+    total = models.LocationRollup.avg_temperature * models.LocationRollup.samples
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id", "day", "city", "country"],
+        set_={
+            "min_temperature": func.min(
+                models.LocationRollup.min_temperature, new.min_temperature
+            ),
+            "max_temperature": func.max(
+                models.LocationRollup.max_temperature, new.max_temperature
+            ),
+            "avg_temperature": (total + new.avg_temperature * new.samples)
+            / (models.LocationRollup.samples + new.samples),
+            "samples": models.LocationRollup.samples + new.samples,
+        },
+    )
+    rows = []
+    for (user_id, day, city, country), (low, high, total, samples) in rollups.items():
+        rows.append(
+            {
+                "user_id": user_id,
+                "day": day,
+                "city": city,
+                "country": country,
+                "min_temperature": low,
+                "max_temperature": high,
+                "avg_temperature": total / samples,
+                "samples": samples,
+            }
+        )
+    await db.execute(statement, rows)
+
+
+# Define a function to fold one batch of expired locations into the rollups
+#
+# The rows are deleted first and folded from what the delete returns, so when
+# several processes compact at once each row is counted by exactly one of them.
+# Failed locations are removed without being counted, and ones still being
+# filled in are left for their worker. Returns the number of rows removed.
+async def compact_batch(db: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    expired = (
+        select(models.Location.id)
+        .where(
+            models.Location.timestamp < cutoff,
+            models.Location.status.in_(("ready", "failed")),
+        )
+        .order_by(models.Location.timestamp)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    rows = (
+        await db.execute(
+            delete(models.Location)
+            .where(models.Location.id.in_(expired))
+            .returning(
+                models.Location.user_id,
+                models.Location.city,
+                models.Location.country,
+                models.Location.timestamp,
+                models.Location.temperature,
+                models.Location.status,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    if not rows:
+        await db.rollback()
+        return 0
+
+    rollups = _fold(rows)
+    if rollups:
+        await _merge_rollups(db, rollups)
+
+    # Keep the maintained location counts in step with the rows left. Failed
+    # locations were taken out of them when they were given up on
+    removed = Counter(row.user_id for row in rows if row.status != "failed")
+    users_table = models.User.__table__
+    if removed:
+        await db.execute(
+            users_table.update()
+            .where(users_table.c.id == bindparam("user"))
+            .values(location_count=users_table.c.location_count - bindparam("removed")),
+            [{"user": user_id, "removed": count} for user_id, count in removed.items()],
+        )
+    await db.commit()
+    for user_id in removed:
+        users.invalidate(user_id)
+    return len(rows)
+
+
+# Define a function to compact every location older than the retention horizon
+async def run_once(session_factory: async_sessionmaker) -> int:
+    settings = get_settings()
+    if settings.retention_days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=settings.retention_days)
+    removed = 0
+    async with session_factory() as db:
+        while not _worker.stopping:
+            batch = await compact_batch(db, cutoff, settings.retention_batch_size)
+            removed += batch
+            if batch < settings.retention_batch_size:
+                break
+            await asyncio.sleep(settings.retention_pause)
+    return removed
+
+
+# Define a function to build a query of a user's daily history, raw and rolled up
+#
+# Recent days are aggregated from the raw locations and older ones come from
+# the rollups. The day the retention horizon falls on is split between the two,
+# so they are merged, weighting each average by its samples.
+def history(user_id: int, since: Optional[date], until: Optional[date]) -> Select:
+    rolled = select(
+        models.LocationRollup.day,
+        models.LocationRollup.city,
+        models.LocationRollup.country,
+        models.LocationRollup.min_temperature,
+        models.LocationRollup.max_temperature,
+        (models.LocationRollup.avg_temperature * models.LocationRollup.samples).label(
+            "total"
+        ),
+        models.LocationRollup.samples,
+    ).where(models.LocationRollup.user_id == user_id)
+
+    day = type_coerce(func.date(models.Location.timestamp), Date)
+    city = func.coalesce(models.Location.city, "")
+    country = func.coalesce(models.Location.country, "")
+    raw = (
+        select(
+            day,
+            city,
+            country,
+            func.min(models.Location.temperature),
+            func.max(models.Location.temperature),
+            func.sum(models.Location.temperature),
+            func.count(models.Location.temperature),
+        )
+        .where(
+            models.Location.user_id == user_id,
+            models.Location.status == "ready",
+            models.Location.temperature.isnot(None),
+        )
+        .group_by(day, city, country)
+    )
+
+    if since is not None:
+        rolled = rolled.where(models.LocationRollup.day >= since)
+        raw = raw.where(models.Location.timestamp >= datetime.combine(since, time()))
+    if until is not None:
+        rolled = rolled.where(models.LocationRollup.day <= until)
+        raw = raw.where(
+            models.Location.timestamp
+            < datetime.combine(until + timedelta(days=1), time())
+        )
+
+    merged = union_all(rolled, raw).subquery()
+    return (
+        select(
+            merged.c.day,
+            merged.c.city,
+            merged.c.country,
+            func.min(merged.c.min_temperature).label("min_temperature"),
+            func.max(merged.c.max_temperature).label("max_temperature"),
+            (func.sum(merged.c.total) / func.sum(merged.c.samples)).label(
+                "avg_temperature"
+            ),
+            func.sum(merged.c.samples).label("samples"),
+        )
+        .group_by(merged.c.day, merged.c.city, merged.c.country)
+        .order_by(desc(merged.c.day), merged.c.city, merged.c.country)
+    )
+
+
+# Define a function to compact old locations, leaving the rest for the next interval
+async def _compact(session_factory: async_sessionmaker) -> bool:
+    removed = await run_once(session_factory)
+    if removed:
+        logger.info("Folded %s old locations into rollups", removed)
+    return False
+
+
+# Worker compacting old locations
+_worker = background.Worker(_compact, logger, "Location compaction failed")
+
+
+# Define a function to start the compactor
+def start(session_factory: async_sessionmaker):
+    _worker.start(session_factory, get_settings().retention_interval)
+
+
+# Define a function to stop the compactor, leaving the rest for its next run
+async def stop():
+    await _worker.stop()
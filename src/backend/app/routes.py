@@ -1,56 +1,88 @@
-import os
-from datetime import datetime, timedelta
+import asyncio
+import json
+import time
+from datetime import date, datetime, timedelta
 from math import ceil
-from typing import Annotated
+from typing import Annotated, List, Optional
 
-import ipdata
-import requests
-from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from openai import OpenAI
-from passlib.context import CryptContext
-from slowapi import Limiter
 from slowapi.util import get_remote_address
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
-
-from app import database, models, schemas
-
-# Load env files
-load_dotenv()
+from sqlalchemy import delete, desc, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import (
+    advice,
+    credits,
+    database,
+    deletion,
+    export,
+    geolocation,
+    hashing,
+    jobs,
+    models,
+    pagination,
+    ratelimit,
+    retention,
+    schemas,
+    stats,
+    upstream,
+    users,
+)
+from app.cache import TTLCache
+from app.config import get_settings
 
 # Initialise router
 router = APIRouter(prefix="/api/v2")
 
-# Initialise OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Define access token configs
 SECRET_KEY = "testkey"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE = 30
 
-# Define rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Define the location columns listed, in the order of schemas.LocationListing
+LISTING_FIELDS = tuple(schemas.LocationListing.model_fields)
+LISTING_COLUMNS = tuple(models.Location.__table__.c[name] for name in LISTING_FIELDS)
 
 # Define authentication configs
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v2/users/login")
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Verified token payloads, each dropped when its token expires
+_token_cache = None
+
+
+# Define a function to get the database session factory
+def get_session_factory() -> async_sessionmaker:
+    return database.AsyncSessionLocal
+
+
+# Define session factory dependency
+session_factory_dependency = Annotated[async_sessionmaker, Depends(get_session_factory)]
 
 
 # Define a function to get the database
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db(session_factory: session_factory_dependency):
+    async with session_factory() as db:
         yield db
-    finally:
-        db.close()
 
 
 # Define database dependency
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+
+# Define a function to respond with rows read straight from our own tables
+#
+# The rows already have the shape of the route's response model, so they skip
+# response validation and go straight to orjson. Each row becomes an object of
+# the given fields, or of all its columns, and other members are added as given.
+def _rows_response(
+    key: str, rows: list, fields: Optional[tuple] = None, **members
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {key: [dict(zip(fields or row._fields, row)) for row in rows], **members}
+    )
 
 
 # Define a function to create an access token
@@ -71,10 +103,54 @@ def create_refresh_token(username: str, id: int, expires: timedelta):
     return encoded_jwt
 
 
+# Define a function to get the verified token cache
+def get_token_cache() -> TTLCache:
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TTLCache(
+            get_settings().token_cache_size, ACCESS_TOKEN_EXPIRE * 60
+        )
+    return _token_cache
+
+
+# Define a function to decode a token, skipping verification for tokens seen before
+def decode_token(token: str) -> dict:
+    cache = get_token_cache()
+    payload = cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        expires = payload.get("exp")
+        cache.set(
+            token, payload, ttl=None if expires is None else expires - time.time()
+        )
+    return payload
+
+
+# Define a function to key rate limits by user, falling back to the client address
+def rate_limit_key(request: Request) -> str:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            user_id = decode_token(token).get("id")
+        except JWTError:
+            user_id = None
+        if user_id is not None:
+            return f"user:{user_id}"
+    return f"ip:{geolocation.client_ip(request) or get_remote_address(request)}"
+
+
+# Define rate limiter, with sqlite:/// storage served by ratelimit.SQLiteStorage
+limiter = ratelimit.Limiter(
+    key_func=rate_limit_key, storage_uri=get_settings().rate_limit_storage_uri
+)
+
+
 # Define a function to get the current user
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)], db: db_dependency
+):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         id: int = payload.get("id")
         if username is None or id is None:
@@ -82,19 +158,26 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate user.",
             )
-        return {"username": username, "id": id}
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user."
         )
 
+    # Tokens stop working as soon as their user is deleted
+    db_user = await users.get_user(db, id)
+    if db_user is None or db_user["deleted_at"] is not None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user."
+        )
+    return {"username": username, "id": id}
+
 
 # Define a function to authenticate the user
-def authenticate_user(username: str, password: str, db):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user:
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(models.User).where(models.User.username == username))
+    if not user or user.deleted_at is not None:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    if not await hashing.verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -109,8 +192,8 @@ user_dependency = Annotated[dict, Depends(get_current_user)]
 @limiter.limit("20/minute")
 async def register_user(request: Request, db: db_dependency, user: schemas.UserCreate):
     # Check if the new username is unique
-    existing_user = (
-        db.query(models.User).filter(models.User.username == user.username).first()
+    existing_user = await db.scalar(
+        select(models.User).where(models.User.username == user.username)
     )
     if existing_user:
         raise HTTPException(
@@ -119,8 +202,8 @@ async def register_user(request: Request, db: db_dependency, user: schemas.UserC
         )
 
     # Check if the new email is unique
-    existing_user = (
-        db.query(models.User).filter(models.User.email == user.email).first()
+    existing_user = await db.scalar(
+        select(models.User).where(models.User.email == user.email)
     )
     if existing_user:
         raise HTTPException(
@@ -131,11 +214,11 @@ async def register_user(request: Request, db: db_dependency, user: schemas.UserC
     db_user = models.User(
         username=user.username,
         email=user.email,
-        hashed_password=bcrypt_context.hash(user.password),
+        hashed_password=await hashing.hash_password(user.password),
     )
 
     db.add(db_user)
-    db.commit()
+    await db.commit()
     return {"message": "User registered successfully."}
 
 
@@ -147,7 +230,7 @@ async def login(
     form: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: db_dependency,
 ):
-    user = authenticate_user(form.username, form.password, db)
+    user = await authenticate_user(form.username, form.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user."
@@ -163,22 +246,26 @@ async def login(
 # Define a route to get the current user's profile
 @router.get("/users/profile", response_model=schemas.UserAccount)
 @limiter.limit("20/minute")
-def get_user_profile(request: Request, user: user_dependency, db: db_dependency):
-    db_user = db.query(models.User).filter(models.User.id == user["id"]).first()
+async def get_user_profile(request: Request, user: user_dependency, db: db_dependency):
+    db_user = await users.get_user(db, user["id"])
+    if not db_user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+        )
 
-    return {"username": db_user.username, "credits": db_user.credits}
+    return {"username": db_user["username"], "credits": db_user["credits"]}
 
 
 # Define a route to update the current user's profile
 @router.put("/users/profile", response_model=schemas.UserRefresh)
 @limiter.limit("20/minute")
-def update_user_profile(
+async def update_user_profile(
     request: Request,
     user: schemas.UserUpdate,
     current_user: user_dependency,
     db: db_dependency,
 ):
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
+    db_user = await db.get(models.User, current_user["id"])
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
@@ -192,8 +279,8 @@ def update_user_profile(
 
     # Check if the new username is unique
     if user.username is not None:
-        existing_user = (
-            db.query(models.User).filter(models.User.username == user.username).first()
+        existing_user = await db.scalar(
+            select(models.User).where(models.User.username == user.username)
         )
         if existing_user:
             raise HTTPException(
@@ -202,10 +289,10 @@ def update_user_profile(
             )
         db_user.username = user.username
 
-    db.commit()
+    await db.commit()
+    users.invalidate(current_user["id"])
 
     # Create new access and refresh tokens
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
     access_token = create_access_token(
         db_user.username, current_user["id"], timedelta(minutes=30)
     )
@@ -220,188 +307,605 @@ def update_user_profile(
 # Define a route to delete the current user's profile
 @router.delete("/users/profile", response_model=schemas.SuccessMessage)
 @limiter.limit("20/minute")
-def delete_user_profile(
+async def delete_user_profile(
     request: Request, current_user: user_dependency, db: db_dependency
 ):
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
-    if not db_user:
+    if not await deletion.tombstone(db, current_user["id"]):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
         )
 
-    db.query(models.Location).filter(models.Location.user_id == db_user.id).delete()
-    db.delete(db_user)
-    db.commit()
+    # Remove the user's history in the background
+    deletion.notify()
     return {"message": "User deleted successfully."}
 
 
 # Define a route to get the current user's credit balance
 @router.get("/credits", response_model=schemas.UserBalance)
 @limiter.limit("20/minute")
-def get_user_credits(
+async def get_user_credits(
     request: Request, current_user: user_dependency, db: db_dependency
 ):
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
+    db_user = await users.get_user(db, current_user["id"])
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
         )
-    return {"credits": db_user.credits}
+    return {"credits": db_user["credits"]}
 
 
 # Define a route for the user to purchase credits
 @router.post("/credits/purchase", response_model=schemas.SuccessMessage)
 @limiter.limit("20/minute")
-def purchase_credits(
+async def purchase_credits(
     request: Request,
     amount: int,
     current_user: user_dependency,
     db: db_dependency,
 ):
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
-    if not db_user:
+    if not await credits.add_credits(db, current_user["id"], amount):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
         )
-    db_user.credits += amount
-    db.commit()
     return {"message": f"{amount} credits purchased successfully."}
 
 
 # Define a route to get the current user's locations
 @router.get("/users/locations", response_model=schemas.LocationList)
 @limiter.limit("100/minute")
-def get_user_locations(
+async def get_user_locations(
     request: Request,
     current_user: user_dependency,
     db: db_dependency,
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    include_total: bool = Query(True),
 ):
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+    # Read the maintained location count alongside the page of locations
+    location_count = (
+        select(models.User.location_count)
+        .where(models.User.id == current_user["id"])
+        .scalar_subquery()
+    )
+    columns = list(LISTING_COLUMNS)
+    if include_total:
+        columns.append(location_count)
+    query = (
+        select(*columns)
+        .where(
+            models.Location.user_id == current_user["id"],
+            models.Location.status != "failed",
         )
+        .order_by(desc(models.Location.timestamp), models.Location.id)
+    )
 
-    offset = (page - 1) * limit
-    total_locations = (
-        db.query(models.Location).filter(models.Location.user_id == db_user.id).count()
+    # Seek past the cursor when given one, otherwise skip to the requested page
+    if after is not None:
+        try:
+            query = query.where(pagination.after_cursor(after))
+        except pagination.InvalidCursor:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Invalid cursor.",
+            )
+    else:
+        query = query.offset((page - 1) * limit)
+
+    # Fetch one extra row to find out whether there is a next page
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    if rows:
+        total_locations = rows[0][-1] if include_total else None
+    else:
+        # An empty page does not say whether the user exists, so look them up
+        db_user = await users.get_user(db, current_user["id"])
+        if db_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+            )
+        total_locations = db_user["location_count"]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor(rows[-1])
+
+    # The location count read alongside each row is left out by the listed fields
+    return _rows_response(
+        "locations",
+        rows,
+        LISTING_FIELDS,
+        pages=ceil(total_locations / limit) if include_total else None,
+        next_cursor=next_cursor,
     )
-    total_pages = ceil(total_locations / limit)
-    user_locations = (
-        db.query(models.Location)
-        .filter(models.Location.user_id == db_user.id)
-        .order_by(desc(models.Location.timestamp))
-        .offset(offset)
-        .limit(limit)
-        .all()
+
+
+# Define the route to stream all of the current user's locations
+@router.get("/users/locations/export")
+@limiter.limit("10/minute")
+async def export_user_locations(
+    request: Request,
+    current_user: user_dependency,
+    session_factory: session_factory_dependency,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = Query(None),
+):
+    return StreamingResponse(
+        export.stream_locations(session_factory, current_user["id"], format, since),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="locations.{format}"'},
     )
 
-    return {"locations": user_locations, "pages": total_pages}
+
+# Define a route to get the current user's statistics for each city they have been in
+@router.get("/users/locations/stats", response_model=schemas.LocationStats)
+@limiter.limit("100/minute")
+async def get_user_location_stats(
+    request: Request, current_user: user_dependency, db: db_dependency
+):
+    rows = (await db.execute(stats.summary(current_user["id"]))).all()
+    return _rows_response("cities", rows)
+
+
+# Define a route to get the current user's daily history, including compacted days
+@router.get("/users/locations/history", response_model=schemas.LocationHistory)
+@limiter.limit("100/minute")
+async def get_user_location_history(
+    request: Request,
+    current_user: user_dependency,
+    db: db_dependency,
+    since: Optional[date] = Query(None),
+    until: Optional[date] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    query = retention.history(current_user["id"], since, until).limit(limit)
+    rows = (await db.execute(query)).all()
+    return _rows_response("days", rows)
+
+
+# Define a function to reserve a location's cost and look up the caller's weather
+#
+# Returns None when the user cannot afford another location. Upstream failures
+# are raised as UpstreamError once the reserved credits have been refunded.
+async def _reserve_and_locate(
+    db: AsyncSession, user_id: int, ip: Optional[str]
+) -> Optional[dict]:
+    # Step 1: Reserve the credits while the geolocation lookup is in flight
+    lookup = asyncio.ensure_future(geolocation.locate(ip))
+    try:
+        reserved = await credits.reserve_credits(db, user_id, credits.LOCATION_COST)
+    except BaseException:
+        lookup.cancel()
+        raise
+    if not reserved:
+        lookup.cancel()
+        if not await users.get_user(db, user_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+            )
+        return None
+
+    try:
+        # Step 2: Get the caller's coordinates, skipping the API for known networks
+        try:
+            location = await lookup
+        except Exception as e:
+            raise upstream.UpstreamError("Failed to retrieve user's location") from e
+
+        # Step 3: Fetch weather data from OpenWeather API using obtained coordinates
+        try:
+            weather = await upstream.get_weather(
+                location["latitude"], location["longitude"]
+            )
+        except Exception as e:
+            raise upstream.UpstreamError("Failed to retrieve weather data") from e
+    except BaseException:
+        await asyncio.shield(credits.refund_credits(db, user_id, credits.LOCATION_COST))
+        raise
+
+    return {
+        "city": location["city"],
+        "country": location["country"],
+        "latitude": location["latitude"],
+        "longitude": location["longitude"],
+        "temperature": weather["temperature"],
+        "description": weather["description"],
+    }
+
+
+# Define a function to save a located user's location with its weather advice
+async def _save_location(
+    db: AsyncSession, user_id: int, found: dict, weather_info: str
+) -> models.Location:
+    row = {
+        "city": found["city"],
+        "country": found["country"],
+        "temperature": found["temperature"],
+        "description": weather_info,
+        "latitude": found["latitude"],
+        "longitude": found["longitude"],
+        "user_id": user_id,
+        "timestamp": datetime.utcnow(),
+    }
+    db_location = models.Location(**row)
+    db.add(db_location)
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(location_count=models.User.location_count + 1)
+    )
+    await stats.record(db, [row])
+    await db.commit()
+    users.invalidate(user_id)
+    return db_location
 
 
 # Define the route to add the current user's current location
 @router.post("/users/locations", response_model=schemas.SuccessMessage)
 @limiter.limit("10/minute")
-def add_user_location(
+async def add_user_location(
     request: Request,
     current_user: user_dependency,
     db: db_dependency,
+    locale: Optional[str] = Query(None, max_length=35),
 ):
-    # Step 1: Get user's coordinates from geolocation API (Example: IP Geolocation API)
-    geolocation_api_key = os.getenv("GEOLOCATION_API_KEY")
-    ipdata.api_key = geolocation_api_key
     try:
-        data = ipdata.lookup()
-        latitude = data.latitude
-        longitude = data.longitude
-        city = data.city
-        country = data.country_name
-    except Exception as e:
-        return {"message": "Failed to retrieve user's location"}
-
-    # Step 2: Fetch weather data from OpenWeather API using obtained coordinates
-    openweather_api_key = os.getenv("OPENWEATHER_API_KEY")
-    openweather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}&appid={openweather_api_key}"
+        found = await _reserve_and_locate(
+            db, current_user["id"], geolocation.client_ip(request)
+        )
+    except upstream.UpstreamError as e:
+        return {"message": str(e)}
+    if found is None:
+        return {"message": "Insufficient credits to add location"}
 
+    # Refund the reservation if any later step fails
     try:
-        weather_response = requests.get(openweather_url)
-        weather_data = weather_response.json()
-        temperature = weather_data["main"]["temp"]
-        description = weather_data["weather"][0]["description"]
-    except Exception as e:
-        return {"message": "Failed to retrieve weather data"}
-
-    # Step 3: Deduct credits from the user
-    credit_cost = 400  # Define the cost for adding a location
-    db_user = db.query(models.User).filter(models.User.id == current_user["id"]).first()
-    if not db_user:
+        # Step 4: AI complete the message, reusing advice given for similar weather
+        weather_info = await advice.get_weather_advice(
+            db,
+            found["city"],
+            found["country"],
+            found["temperature"],
+            found["description"],
+            locale,
+        )
+        await _save_location(db, current_user["id"], found, weather_info)
+    except BaseException:
+        await asyncio.shield(
+            credits.refund_credits(db, current_user["id"], credits.LOCATION_COST)
+        )
+        raise
+
+    return {
+        "message": "Location added successfully",
+    }
+
+
+# Define the route to queue the current user's current location to be filled in later
+@router.post(
+    "/users/locations/jobs",
+    response_model=schemas.LocationJobAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+@limiter.limit("10/minute")
+async def queue_user_location(
+    request: Request,
+    current_user: user_dependency,
+    db: db_dependency,
+    locale: Optional[str] = Query(None, max_length=35),
+):
+    if not await credits.reserve_credits(db, current_user["id"], credits.LOCATION_COST):
+        if not await users.get_user(db, current_user["id"]):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+            )
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient credits to add location.",
         )
-    if db_user.credits < credit_cost:
-        return {"message": "Insufficient credits to add location"}
 
-    db_user.credits -= credit_cost
-    db.commit()
+    # Save a pending location for the workers, refunding the reservation on failure
+    try:
+        db_location = jobs.queue_location(
+            current_user["id"], locale, geolocation.client_ip(request)
+        )
+        db.add(db_location)
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == current_user["id"])
+            .values(location_count=models.User.location_count + 1)
+        )
+        await db.commit()
+        users.invalidate(current_user["id"])
+    except BaseException:
+        await asyncio.shield(
+            credits.refund_credits(db, current_user["id"], credits.LOCATION_COST)
+        )
+        raise
+    jobs.notify()
 
-    # Step 4: Format the response
-    location_info = f"{city}, {country}"
-    weather_info = f"The weather in {location_info} is currently {temperature - 273.15} degrees Celsius with {description}."
+    return {
+        "message": "Location queued.",
+        "job_id": db_location.id,
+        "status": db_location.status,
+    }
 
-    # Step 5: AI complete the message
-    completion = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "user",
-                "content": f"You are a weather assistant, and I want you to extend the following sentence with a little message about what to wear: {weather_info}",
-            },
-        ],
-        max_tokens=100,
+
+# Define the route to report the progress of a queued location
+@router.get("/users/locations/jobs/{job_id}", response_model=schemas.LocationJob)
+@limiter.limit("100/minute")
+async def get_user_location_job(
+    request: Request,
+    job_id: int,
+    current_user: user_dependency,
+    db: db_dependency,
+):
+    db_location = await db.scalar(
+        select(models.Location).where(
+            models.Location.id == job_id,
+            models.Location.user_id == current_user["id"],
+        )
     )
-    weather_info = completion.choices[0].message.content
-
-    db_location = models.Location(
-        city=city,
-        country=country,
-        temperature=temperature,
-        description=weather_info,
-        latitude=latitude,
-        longitude=longitude,
-        user_id=current_user["id"],
+    if not db_location:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found."
+        )
+    return {
+        "job_id": db_location.id,
+        "status": db_location.status,
+        "attempts": db_location.attempts,
+        "location": db_location if db_location.status == "ready" else None,
+    }
+
+
+# Define a function to format a Server-Sent Event
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Define a function to stream the advice for a located user and then save it
+async def _stream_location(
+    session_factory: async_sessionmaker,
+    user_id: int,
+    found: dict,
+    locale: Optional[str],
+    saved: asyncio.Event,
+):
+    async with session_factory() as db:
+        try:
+            yield _sse("weather", found)
+            chunks = []
+            async for chunk in advice.stream_weather_advice(
+                db,
+                found["city"],
+                found["country"],
+                found["temperature"],
+                found["description"],
+                locale,
+            ):
+                chunks.append(chunk)
+                yield _sse("advice", {"text": chunk})
+            db_location = await _save_location(db, user_id, found, "".join(chunks))
+            saved.set()
+        except Exception:
+            yield _sse("error", {"message": "Failed to retrieve weather advice"})
+            return
+        yield _sse(
+            "done", {"message": "Location added successfully", "id": db_location.id}
+        )
+
+
+# Define a streaming response that refunds a reserved location unless it was saved
+#
+# The refund runs once the response has ended however it ended, including when
+# the client leaves while the headers are sent and the stream never starts.
+class LocationStream(StreamingResponse):
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        user_id: int,
+        found: dict,
+        locale: Optional[str],
+        **kwargs,
+    ):
+        self.session_factory = session_factory
+        self.user_id = user_id
+        self.saved = asyncio.Event()
+        super().__init__(
+            _stream_location(session_factory, user_id, found, locale, self.saved),
+            **kwargs,
+        )
+
+    async def _refund(self):
+        async with self.session_factory() as db:
+            await credits.refund_credits(db, self.user_id, credits.LOCATION_COST)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.saved.is_set():
+                await asyncio.shield(self._refund())
+
+
+# Define the route to add the current user's current location, streaming the advice
+@router.post("/users/locations/stream")
+@limiter.limit("10/minute")
+async def stream_user_location(
+    request: Request,
+    current_user: user_dependency,
+    db: db_dependency,
+    session_factory: session_factory_dependency,
+    locale: Optional[str] = Query(None, max_length=35),
+):
+    try:
+        found = await _reserve_and_locate(
+            db, current_user["id"], geolocation.client_ip(request)
+        )
+    except upstream.UpstreamError as e:
+        return {"message": str(e)}
+    if found is None:
+        return {"message": "Insufficient credits to add location"}
+
+    # Send the weather straight away, then the advice as it is written
+    return LocationStream(
+        session_factory,
+        current_user["id"],
+        found,
+        locale,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    db.add(db_location)
-    db.commit()
-    db.refresh(db_location)
+
+
+# Define a function to fetch the weather and advice for one location in a batch
+async def _capture_location(
+    semaphore: asyncio.Semaphore,
+    session_factory: async_sessionmaker,
+    location: schemas.LocationBase,
+    user_id: int,
+    locale: Optional[str],
+):
+    async with semaphore:
+        try:
+            weather = await upstream.get_city_weather(location.city, location.country)
+        except Exception:
+            return None, "Failed to retrieve weather data"
+
+        # Each location gets its own session so advice can be loaded concurrently
+        try:
+            async with session_factory() as db:
+                weather_info = await advice.get_weather_advice(
+                    db,
+                    location.city,
+                    location.country,
+                    weather["temperature"],
+                    weather["description"],
+                    locale,
+                )
+        except Exception:
+            return None, "Failed to retrieve weather advice"
+
+    row = {
+        "city": location.city,
+        "country": location.country,
+        "temperature": weather["temperature"],
+        "description": weather_info,
+        "latitude": weather["latitude"],
+        "longitude": weather["longitude"],
+        "user_id": user_id,
+    }
+    return row, "Location added successfully"
+
+
+# Define the route to add several locations for the current user at once
+@router.post("/users/locations/batch", response_model=schemas.LocationBatchResult)
+@limiter.limit("5/minute")
+async def add_user_locations(
+    request: Request,
+    current_user: user_dependency,
+    db: db_dependency,
+    session_factory: session_factory_dependency,
+    locations: List[schemas.LocationBase],
+    locale: Optional[str] = Query(None, max_length=35),
+):
+    settings = get_settings()
+    if not 1 <= len(locations) <= settings.batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A batch must hold between 1 and {settings.batch_max_size} locations.",
+        )
+
+    # Step 1: Reserve the credits for the whole batch at once
+    cost = credits.LOCATION_COST * len(locations)
+    if not await credits.reserve_credits(db, current_user["id"], cost):
+        if not await users.get_user(db, current_user["id"]):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="User not found."
+            )
+        return {"message": "Insufficient credits to add locations", "results": []}
+
+    try:
+        # Step 2: Fetch the weather and advice for every location concurrently
+        semaphore = asyncio.Semaphore(settings.batch_concurrency)
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(
+                    _capture_location(
+                        semaphore, session_factory, location, current_user["id"], locale
+                    )
+                )
+                for location in locations
+            ]
+        outcomes = [task.result() for task in tasks]
+
+        # Step 3: Write every captured location with one insert and one commit
+        now = datetime.utcnow()
+        rows = [{**row, "timestamp": now} for row, _ in outcomes if row is not None]
+        if rows:
+            await db.execute(insert(models.Location), rows)
+            await db.execute(
+                update(models.User)
+                .where(models.User.id == current_user["id"])
+                .values(location_count=models.User.location_count + len(rows))
+            )
+            await stats.record(db, rows)
+            await db.commit()
+            users.invalidate(current_user["id"])
+    except BaseException:
+        await asyncio.shield(credits.refund_credits(db, current_user["id"], cost))
+        raise
+
+    # Step 4: Give back the credits reserved for locations that failed
+    failed = len(locations) - len(rows)
+    if failed:
+        await credits.refund_credits(
+            db, current_user["id"], credits.LOCATION_COST * failed
+        )
 
     return {
-        "message": "Location added successfully",
+        "message": f"{len(rows)} of {len(locations)} locations added successfully",
+        "results": [
+            {
+                "city": location.city,
+                "country": location.country,
+                "added": row is not None,
+                "message": message,
+            }
+            for location, (row, message) in zip(locations, outcomes)
+        ],
     }
 
 
 # Define a route to delete one of the current user's locations
 @router.delete("/users/locations/{location_id}", response_model=schemas.SuccessMessage)
 @limiter.limit("20/minute")
-def delete_user_location(
+async def delete_user_location(
     request: Request,
     location_id: int,
     current_user: user_dependency,
     db: db_dependency,
 ):
-    db_location = (
-        db.query(models.Location)
-        .filter(
+    db_location = await db.scalar(
+        select(models.Location).where(
             models.Location.id == location_id,
             models.Location.user_id == current_user["id"],
         )
-        .first()
     )
     if not db_location:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Location not found."
         )
-    db.delete(db_location)
-    db.commit()
+    await db.delete(db_location)
+
+    # Failed locations were taken out of the count when they were given up on
+    if db_location.status != "failed":
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == current_user["id"])
+            .values(location_count=models.User.location_count - 1)
+        )
+    await stats.forget(db, db_location)
+    await db.commit()
+    users.invalidate(current_user["id"])
     return {"message": "Location deleted successfully."}
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional, Union
 
 from pydantic import BaseModel, EmailStr
@@ -53,11 +53,13 @@ class LocationListing(BaseModel):
     country: Optional[str]
     id: Optional[int]
     description: Optional[str]
+    status: Optional[str] = None
 
 
 class LocationList(BaseModel):
     locations: List[Optional[LocationListing]]
-    pages: int
+    pages: Optional[int]
+    next_cursor: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -86,3 +88,52 @@ class SuccessMessage(BaseModel):
 class Token(SuccessMessage):
     access_token: str
     token_type: str
+
+
+class LocationBatchItem(LocationBase):
+    added: bool
+    message: str
+
+
+class LocationBatchResult(SuccessMessage):
+    results: List[LocationBatchItem]
+
+
+class LocationJobAccepted(SuccessMessage):
+    job_id: int
+    status: str
+
+
+class LocationJob(BaseModel):
+    job_id: int
+    status: str
+    attempts: int
+    location: Optional[LocationListing]
+
+
+class LocationHistoryDay(BaseModel):
+    day: date
+    city: str
+    country: str
+    min_temperature: Optional[float]
+    max_temperature: Optional[float]
+    avg_temperature: Optional[float]
+    samples: int
+
+
+class LocationHistory(BaseModel):
+    days: List[LocationHistoryDay]
+
+
+class LocationCityStats(BaseModel):
+    city: str
+    country: str
+    samples: int
+    avg_temperature: Optional[float]
+    min_temperature: Optional[float]
+    max_temperature: Optional[float]
+    last_seen: Optional[datetime]
+
+
+class LocationStats(BaseModel):
+    cities: List[LocationCityStats]
@@ -0,0 +1,254 @@
+import asyncio
+from datetime import datetime, time
+from typing import Optional
+
+from sqlalchemy import Select, delete, desc, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import database, models
+
+
+# Define a function to get the key a location's statistics are kept under
+def _key(user_id: int, city: Optional[str], country: Optional[str]) -> tuple:
+    return (user_id, city or "", country or "")
+
+
+# Define a function to add newly saved locations to their users' statistics
+#
+# Called in the transaction that saves the locations, so the statistics never
+# disagree with them. Locations without a temperature are not counted.
+async def record(db: AsyncSession, locations: list):
+    totals = {}
+    for location in locations:
+        temperature = location["temperature"]
+        if temperature is None:
+            continue
+        key = _key(location["user_id"], location["city"], location["country"])
+        total = totals.get(key)
+        if total is None:
+            seen = location["timestamp"]
+            totals[key] = [1, temperature, temperature, temperature, seen]
+        else:
+            total[0] += 1
+            total[1] += temperature
+            total[2] = min(total[2], temperature)
+            total[3] = max(total[3], temperature)
+            total[4] = max(total[4], location["timestamp"])
+    if not totals:
+        return
+
+    stat = models.LocationStat
+    statement = insert(stat)
+    new = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id", "city", "country"],
+        set_={
+            "samples": stat.samples + new.samples,
+            "temperature_sum": stat.temperature_sum + new.temperature_sum,
+            "min_temperature": func.coalesce(
+                func.min(stat.min_temperature, new.min_temperature),
+                new.min_temperature,
+            ),
+            "max_temperature": func.coalesce(
+                func.max(stat.max_temperature, new.max_temperature),
+                new.max_temperature,
+            ),
+            "last_seen": func.coalesce(
+                func.max(stat.last_seen, new.last_seen), new.last_seen
+            ),
+        },
+    )
+    rows = []
+    for (user_id, city, country), (samples, total, low, high, seen) in totals.items():
+        rows.append(
+            {
+                "user_id": user_id,
+                "city": city,
+                "country": country,
+                "samples": samples,
+                "temperature_sum": total,
+                "min_temperature": low,
+                "max_temperature": high,
+                "last_seen": seen,
+            }
+        )
+    await db.execute(statement, rows)
+
+
+# Define a function to total a user's locations and rollups, optionally for one city
+#
+# Rolled up days only record the day, so a city last seen in them is reported
+# as last seen at the start of that day.
+async def _aggregate(
+    db: AsyncSession,
+    user_id: int,
+    key: Optional[tuple] = None,
+    exclude: Optional[int] = None,
+) -> dict:
+    city = func.coalesce(models.Location.city, "")
+    country = func.coalesce(models.Location.country, "")
+    raw = (
+        select(
+            city,
+            country,
+            func.count(models.Location.temperature),
+            func.sum(models.Location.temperature),
+            func.min(models.Location.temperature),
+            func.max(models.Location.temperature),
+            func.max(models.Location.timestamp),
+        )
+        .where(
+            models.Location.user_id == user_id,
+            models.Location.status == "ready",
+            models.Location.temperature.isnot(None),
+        )
+        .group_by(city, country)
+    )
+    rollup = models.LocationRollup
+    rolled = (
+        select(
+            rollup.city,
+            rollup.country,
+            func.sum(rollup.samples),
+            func.sum(rollup.avg_temperature * rollup.samples),
+            func.min(rollup.min_temperature),
+            func.max(rollup.max_temperature),
+            func.max(rollup.day),
+        )
+        .where(rollup.user_id == user_id)
+        .group_by(rollup.city, rollup.country)
+    )
+    if key is not None:
+        raw = raw.where(city == key[1], country == key[2])
+        rolled = rolled.where(rollup.city == key[1], rollup.country == key[2])
+    if exclude is not None:
+        raw = raw.where(models.Location.id != exclude)
+
+    totals = {}
+    for rows in (await db.execute(raw), await db.execute(rolled)):
+        for city_name, country_name, samples, total, low, high, seen in rows:
+            if not samples:
+                continue
+            if not isinstance(seen, datetime):
+                seen = datetime.combine(seen, time())
+            merged = totals.get((city_name, country_name))
+            if merged is None:
+                totals[(city_name, country_name)] = {
+                    "user_id": user_id,
+                    "city": city_name,
+                    "country": country_name,
+                    "samples": samples,
+                    "temperature_sum": total,
+                    "min_temperature": low,
+                    "max_temperature": high,
+                    "last_seen": seen,
+                }
+            else:
+                merged["samples"] += samples
+                merged["temperature_sum"] += total
+                merged["min_temperature"] = min(merged["min_temperature"], low)
+                merged["max_temperature"] = max(merged["max_temperature"], high)
+                merged["last_seen"] = max(merged["last_seen"], seen)
+    return totals
+
+
+# Define a function to replace stored statistics with freshly computed ones
+async def _replace(
+    db: AsyncSession,
+    user_id: int,
+    key: Optional[tuple] = None,
+    exclude: Optional[int] = None,
+):
+    stat = models.LocationStat
+    # Write first, so the totals are read under the write lock and cannot go stale
+    statement = delete(stat).where(stat.user_id == user_id)
+    if key is not None:
+        statement = statement.where(stat.city == key[1], stat.country == key[2])
+    await db.execute(statement)
+    totals = await _aggregate(db, user_id, key, exclude)
+    if totals:
+        await db.execute(insert(stat), list(totals.values()))
+
+
+# Define a function to take a deleted location out of its user's statistics
+#
+# Counts and sums are adjusted in place. Extremes and the last seen time cannot
+# be, so when the location held one of them the city is totalled again.
+async def forget(db: AsyncSession, location: models.Location):
+    if location.status != "ready" or location.temperature is None:
+        return
+    key = _key(location.user_id, location.city, location.country)
+    stat = models.LocationStat
+    row = (
+        await db.execute(
+            update(stat)
+            .where(stat.user_id == key[0], stat.city == key[1], stat.country == key[2])
+            .values(
+                samples=stat.samples - 1,
+                temperature_sum=stat.temperature_sum - location.temperature,
+            )
+            .returning(
+                stat.samples, stat.min_temperature, stat.max_temperature, stat.last_seen
+            )
+        )
+    ).first()
+    if row is None:
+        return
+    samples, low, high, seen = row
+    if samples <= 0:
+        await db.execute(
+            delete(stat).where(
+                stat.user_id == key[0], stat.city == key[1], stat.country == key[2]
+            )
+        )
+    elif location.temperature in (low, high) or location.timestamp == seen:
+        await _replace(db, key[0], key, exclude=location.id)
+
+
+# Define a function to build the query of a user's statistics, busiest city first
+def summary(user_id: int) -> Select:
+    stat = models.LocationStat
+    return (
+        select(
+            stat.city,
+            stat.country,
+            stat.samples,
+            (stat.temperature_sum / stat.samples).label("avg_temperature"),
+            stat.min_temperature,
+            stat.max_temperature,
+            stat.last_seen,
+        )
+        .where(stat.user_id == user_id, stat.samples > 0)
+        .order_by(desc(stat.samples), stat.city, stat.country)
+    )
+
+
+# Define a function to rebuild every user's statistics, one user per transaction
+async def backfill(session_factory: async_sessionmaker) -> int:
+    async with session_factory() as db:
+        user_ids = (
+            await db.scalars(
+                select(models.User.id)
+                .where(models.User.deleted_at.is_(None))
+                .order_by(models.User.id)
+            )
+        ).all()
+        for user_id in user_ids:
+            await _replace(db, user_id)
+            await db.commit()
+    return len(user_ids)
+
+
+def main():
+    async def run():
+        try:
+            return await backfill(database.AsyncSessionLocal)
+        finally:
+            await database.async_engine.dispose()
+
+    print(f"Rebuilt location statistics for {asyncio.run(run())} users")
+
+
+if __name__ == "__main__":
+    main()
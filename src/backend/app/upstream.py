@@ -0,0 +1,356 @@
+import asyncio
+import os
+import random
+import sys
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+import httpx
+
+from app import metrics
+from app.breaker import CircuitBreaker
+from app.cache import TTLCache
+from app.config import get_settings
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Define upstream endpoints
+IPDATA_URL = "https://api.ipdata.co"
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+# Define the circuit breaker states as exported to the metrics
+CIRCUIT_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+# Shared clients, created on first use so connections are reused across requests
+_http_client = None
+_openai_client = None
+
+# Circuit breakers keyed by upstream service
+_breakers = {}
+
+# Weather responses keyed by grid cell, with the fetches currently in flight
+_weather_cache = None
+_weather_inflight = {}
+
+
+# Define an error for when an upstream step fails, carrying the message for the user
+class UpstreamError(Exception):
+    pass
+
+
+# Define a function to get the timeout for calls to an upstream service
+def get_timeout(service: str) -> httpx.Timeout:
+    settings = get_settings()
+    timeout = getattr(settings, f"{service}_timeout")
+    return httpx.Timeout(timeout, connect=settings.upstream_connect_timeout)
+
+
+# Define a function to get the connection pool limits of the shared HTTP client
+def get_limits() -> httpx.Limits:
+    settings = get_settings()
+    return httpx.Limits(
+        max_connections=settings.upstream_max_connections,
+        max_keepalive_connections=settings.upstream_max_keepalive,
+        keepalive_expiry=settings.upstream_keepalive_expiry,
+    )
+
+
+# Define a function to get the shared HTTP client
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                10.0, connect=get_settings().upstream_connect_timeout
+            ),
+            limits=get_limits(),
+        )
+    return _http_client
+
+
+# Define a function to get the shared OpenAI client
+#
+# The openai package is slow to import, so it is only imported on first use.
+# Its own retries are turned off so OpenAI calls go through the same retries
+# and circuit breaker as the other upstreams.
+def get_openai_client() -> "AsyncOpenAI":
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=get_http_client(),
+            timeout=get_timeout("openai"),
+            max_retries=0,
+        )
+    return _openai_client
+
+
+# Define a function to close the shared clients
+async def close_clients():
+    global _http_client, _openai_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _openai_client = None
+
+
+# Define a function to get the circuit breaker of an upstream service
+def get_breaker(service: str) -> CircuitBreaker:
+    breaker = _breakers.get(service)
+    if breaker is None:
+        settings = get_settings()
+        breaker = _breakers.setdefault(
+            service,
+            CircuitBreaker(
+                service, settings.breaker_threshold, settings.breaker_reset_after
+            ),
+        )
+    return breaker
+
+
+# Define a function to check whether a failed upstream call is worth retrying
+#
+# OpenAI errors can only have been raised once openai has been imported.
+def _retryable(error: Exception) -> bool:
+    openai = sys.modules.get("openai")
+    if isinstance(error, httpx.TransportError) or (
+        openai is not None and isinstance(error, openai.APIConnectionError)
+    ):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    elif openai is not None and isinstance(error, openai.APIStatusError):
+        status = error.status_code
+    else:
+        return False
+    return status == 429 or status >= 500
+
+
+# Define a function to call an upstream service with retries behind its circuit breaker
+#
+# Connection errors, timeouts, 429s and 5xx responses are retried after a
+# random delay of up to the base delay doubled for each retry ("full jitter"),
+# so clients that failed together do not all retry together. A call that
+# still fails counts against the breaker; other errors mean the service
+# answered, so they count as a success for it.
+async def _call(service: str, request):
+    settings = get_settings()
+    breaker = get_breaker(service)
+    breaker.allow()
+    for attempt in range(settings.upstream_retries + 1):
+        try:
+            with metrics.timer(metrics.UPSTREAM_DURATION, service=service):
+                result = await request()
+        except Exception as e:
+            if not _retryable(e):
+                breaker.record_success()
+                raise
+            if attempt == settings.upstream_retries:
+                breaker.record_failure()
+                raise
+        else:
+            breaker.record_success()
+            return result
+        metrics.UPSTREAM_RETRIES.inc(service=service)
+        delay = min(
+            settings.upstream_retry_max_delay,
+            settings.upstream_retry_delay * 2**attempt,
+        )
+        await asyncio.sleep(random.uniform(0, delay))
+
+
+# Define a function to send a GET request to an upstream service
+async def _get(service: str, url: str, params: dict) -> httpx.Response:
+    async def request():
+        response = await get_http_client().get(
+            url, params=params, timeout=get_timeout(service)
+        )
+        response.raise_for_status()
+        return response
+
+    return await _call(service, request)
+
+
+# Define a function to get the shared connection pool's and circuit breakers' statistics
+def pool_stats() -> dict:
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", ()))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "breakers": {name: breaker.stats() for name, breaker in _breakers.items()},
+    }
+
+
+# Define a function to sample the pool and breaker gauges at scrape time
+def _sample_pool():
+    stats = pool_stats()
+    metrics.UPSTREAM_POOL_CONNECTIONS.set(stats["active"], state="active")
+    metrics.UPSTREAM_POOL_CONNECTIONS.set(stats["idle"], state="idle")
+    for name, breaker in stats["breakers"].items():
+        metrics.UPSTREAM_CIRCUIT_STATE.set(
+            CIRCUIT_STATES[breaker["state"]], service=name
+        )
+
+
+metrics.add_collector(_sample_pool)
+
+
+# Define a function to get an address's coordinates from the geolocation API
+#
+# Without an address, ipdata locates the address the request comes from.
+async def lookup_location(ip: Optional[str] = None) -> dict:
+    response = await _get(
+        "ipdata",
+        f"{IPDATA_URL}/{ip}" if ip else IPDATA_URL,
+        {"api-key": os.getenv("GEOLOCATION_API_KEY")},
+    )
+    data = response.json()
+    return {
+        "latitude": data["latitude"],
+        "longitude": data["longitude"],
+        "city": data["city"],
+        "country": data["country_name"],
+    }
+
+
+# Define a function to fetch the current weather at the given coordinates
+async def fetch_weather(latitude: float, longitude: float) -> dict:
+    response = await _get(
+        "openweather",
+        OPENWEATHER_URL,
+        {
+            "lat": latitude,
+            "lon": longitude,
+            "appid": os.getenv("OPENWEATHER_API_KEY"),
+        },
+    )
+    weather_data = response.json()
+    return {
+        "temperature": weather_data["main"]["temp"],
+        "description": weather_data["weather"][0]["description"],
+    }
+
+
+# Define a function to get the weather cache
+def get_weather_cache() -> TTLCache:
+    global _weather_cache
+    if _weather_cache is None:
+        settings = get_settings()
+        _weather_cache = TTLCache(
+            settings.weather_cache_size, settings.weather_cache_ttl
+        )
+    return _weather_cache
+
+
+# Define a function to get the grid cell containing the given coordinates
+def weather_cache_key(latitude: float, longitude: float) -> tuple:
+    grid = get_settings().weather_cache_grid
+    return (round(latitude / grid), round(longitude / grid))
+
+
+# Define a function to get the weather, reusing recent results for the same grid cell
+async def get_weather(latitude: float, longitude: float) -> dict:
+    key = weather_cache_key(latitude, longitude)
+    return await _cached_weather(key, fetch_weather, latitude, longitude)
+
+
+# Define a function to fetch the current weather and coordinates of a named city
+async def fetch_city_weather(city: str, country: str) -> dict:
+    response = await _get(
+        "openweather",
+        OPENWEATHER_URL,
+        {"q": f"{city},{country}", "appid": os.getenv("OPENWEATHER_API_KEY")},
+    )
+    weather_data = response.json()
+    return {
+        "latitude": weather_data["coord"]["lat"],
+        "longitude": weather_data["coord"]["lon"],
+        "temperature": weather_data["main"]["temp"],
+        "description": weather_data["weather"][0]["description"],
+    }
+
+
+# Define a function to get the weather for a named city, reusing recent results
+async def get_city_weather(city: str, country: str) -> dict:
+    key = ("city", city.strip().lower(), country.strip().lower())
+    return await _cached_weather(key, fetch_city_weather, city, country)
+
+
+# Define a function to serve weather from the cache or a single shared fetch
+async def _cached_weather(key: tuple, fetch, *args) -> dict:
+    cache = get_weather_cache()
+    weather = cache.get(key)
+    if weather is not None:
+        return weather
+
+    # Share a single upstream call between concurrent misses for the same key
+    task = _weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_cache_weather(key, fetch, *args))
+        _weather_inflight[key] = task
+    return await asyncio.shield(task)
+
+
+# Define a function to fetch the weather and store it in the cache
+async def _fetch_and_cache_weather(key: tuple, fetch, *args):
+    try:
+        weather = await fetch(*args)
+        get_weather_cache().set(key, weather)
+        return weather
+    finally:
+        _weather_inflight.pop(key, None)
+
+
+# Define a function to build the prompt asking the AI to extend the weather message
+def weather_prompt(weather_info: str, locale: Optional[str] = None) -> str:
+    prompt = f"You are a weather assistant, and I want you to extend the following sentence with a little message about what to wear: {weather_info}"
+    if locale:
+        prompt += f" Reply in the language of the {locale} locale."
+    return prompt
+
+
+# Define a function to have the AI extend the weather message
+async def complete_weather_info(weather_info: str, locale: Optional[str] = None) -> str:
+    completion = await _call(
+        "openai",
+        lambda: get_openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "user",
+                    "content": weather_prompt(weather_info, locale),
+                },
+            ],
+            max_tokens=100,
+        ),
+    )
+    return completion.choices[0].message.content
+
+
+# Define a function to have the AI extend the weather message, yielding text as it arrives
+async def stream_weather_info(
+    weather_info: str, locale: Optional[str] = None
+) -> AsyncIterator[str]:
+    stream = await _call(
+        "openai",
+        lambda: get_openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "user",
+                    "content": weather_prompt(weather_info, locale),
+                },
+            ],
+            max_tokens=100,
+            stream=True,
+        ),
+    )
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
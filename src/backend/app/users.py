@@ -0,0 +1,112 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.cache import TTLCache
+from app.config import get_settings
+
+# Define the layout of one version counter in the shared file
+SLOT = struct.Struct("=Q")
+
+# Cached user rows and the version counters shared with the other workers
+_user_cache = None
+_versions = None
+
+
+# Define version counters shared by every worker on a host through a mapped file
+#
+# Users are spread over a fixed number of slots. Reading a slot is a load from
+# shared memory, so checking a cached row costs no system call. Bumps hold a
+# lock on just that slot's bytes so concurrent writers never lose an increment.
+class VersionCounters:
+    def __init__(self, path: str, slots: int):
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = slots * SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def _offset(self, key: int) -> int:
+        return (key % self.slots) * SLOT.size
+
+    def get(self, key: int) -> int:
+        return SLOT.unpack_from(self._map, self._offset(key))[0]
+
+    def bump(self, key: int):
+        offset = self._offset(key)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+            try:
+                (version,) = SLOT.unpack_from(self._map, offset)
+                SLOT.pack_into(self._map, offset, version + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+# Define a function to get the user row cache
+def get_user_cache() -> TTLCache:
+    global _user_cache
+    if _user_cache is None:
+        settings = get_settings()
+        _user_cache = TTLCache(settings.user_cache_size, settings.user_cache_ttl)
+    return _user_cache
+
+
+# Define a function to get the shared version counters
+def get_versions() -> VersionCounters:
+    global _versions
+    if _versions is None:
+        settings = get_settings()
+        _versions = VersionCounters(
+            settings.user_cache_version_path, settings.user_cache_slots
+        )
+    return _versions
+
+
+# Define a function to get a user's row, reusing it until any worker changes the user
+#
+# The version is read before the row, so a change committed while the row is
+# loaded leaves the cached copy already out of date rather than hiding it.
+async def get_user(db: AsyncSession, user_id: int) -> Optional[dict]:
+    version = get_versions().get(user_id)
+    cached = get_user_cache().get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    row = (
+        await db.execute(
+            select(
+                models.User.id,
+                models.User.username,
+                models.User.credits,
+                models.User.location_count,
+                models.User.deleted_at,
+            ).where(models.User.id == user_id)
+        )
+    ).first()
+    if row is None:
+        return None
+    user = row._asdict()
+    get_user_cache().set(user_id, (version, user))
+    return user
+
+
+# Define a function to drop a user's cached row here and in every other worker
+#
+# Called once a change to the user has been committed.
+def invalidate(user_id: int):
+    get_user_cache().pop(user_id)
+    get_versions().bump(user_id)
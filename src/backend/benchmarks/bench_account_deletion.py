@@ -0,0 +1,144 @@
+"""Compare write latency while a large account is deleted in one transaction or purged in chunks.
+
+Each run seeds a database in which one user has `--locations` locations, then
+measures the latency of concurrent location writes by other users: with no
+deletion running, while the account is deleted in a single transaction, and
+while the deletion purge removes it in chunks. Writers keep writing until the
+deletion has finished, or for `--idle` seconds when there is none.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_account_deletion`.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import delete, event, insert, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import deletion, models
+from app.database import Base, apply_storage_profile, pool_options
+
+# Define the id of the user whose account is deleted
+LARGE_USER = 0
+
+
+# Define a function to build an engine on a database seeded with one large account
+async def make_engine(path: str, locations: int):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        poolclass=AsyncAdaptedQueuePool,
+        **pool_options(),
+    )
+    event.listen(engine.sync_engine, "connect", apply_storage_profile)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(models.User),
+            [{"id": i, "username": f"user{i}", "credits": 10**9} for i in range(100)],
+        )
+        await conn.execute(
+            insert(models.Location),
+            [{"city": "Birmingham", "user_id": LARGE_USER}] * locations,
+        )
+    return engine
+
+
+# Define a function to delete the large account in one transaction, as before the purge
+async def delete_at_once(SessionLocal):
+    async with SessionLocal() as db:
+        await db.execute(
+            delete(models.Location).where(models.Location.user_id == LARGE_USER)
+        )
+        await db.execute(delete(models.User).where(models.User.id == LARGE_USER))
+        await db.commit()
+
+
+# Define a function to delete the large account through the tombstone and purge
+async def delete_in_chunks(SessionLocal):
+    async with SessionLocal() as db:
+        await deletion.tombstone(db, LARGE_USER)
+        await deletion.purge(db, LARGE_USER)
+
+
+# Define a function to add one location, mirroring the writes of a location add
+async def write(SessionLocal, user_id: int):
+    async with SessionLocal() as db:
+        db.add(models.Location(city="Birmingham", user_id=user_id))
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(location_count=models.User.location_count + 1)
+        )
+        await db.commit()
+
+
+# Define a function to run one writer until told to stop, recording each write's latency
+async def writer(SessionLocal, user_id: int, done: asyncio.Event, latencies: list):
+    while not done.is_set():
+        start = time.perf_counter()
+        await write(SessionLocal, user_id)
+        latencies.append((time.perf_counter() - start) * 1e3)
+        await asyncio.sleep(0.01)
+
+
+# Define a function to measure write latency while the account is deleted one way
+async def run(remove, locations: int, writers: int, idle: float) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = await make_engine(os.path.join(directory, "bench.db"), locations)
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+        users = range(1, writers + 1)
+
+        # Open the pool's connections before timing anything
+        await asyncio.gather(*(write(SessionLocal, i) for i in users))
+
+        done = asyncio.Event()
+        latencies = []
+        tasks = [
+            asyncio.create_task(writer(SessionLocal, i, done, latencies)) for i in users
+        ]
+        start = time.perf_counter()
+        if remove is None:
+            await asyncio.sleep(idle)
+        else:
+            await remove(SessionLocal)
+        elapsed = time.perf_counter() - start
+        done.set()
+        await asyncio.gather(*tasks)
+        await engine.dispose()
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "max": latencies[-1],
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--locations", type=int, default=200000)
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--idle", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'':10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'seconds':>10}")
+    for label, remove in (
+        ("idle", None),
+        ("at once", delete_at_once),
+        ("chunked", delete_in_chunks),
+    ):
+        result = asyncio.run(run(remove, args.locations, args.writers, args.idle))
+        print(
+            f"{label:10}{result['p50']:>10.1f}{result['p99']:>10.1f}"
+            f"{result['max']:>10.1f}{result['seconds']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Compare CPU per request for 100-row location pages with and without the fast path.
+
+The baseline route lists the same page the way get_user_locations used to, by
+returning ORM objects that FastAPI validates against schemas.LocationList and
+encodes with the standard JSON response.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_list_response`.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import desc, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app import models, routes, schemas
+from app.database import Base
+from app.main import app
+
+PAGE_SIZE = 100
+
+engine = create_async_engine(
+    "sqlite+aiosqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+baseline_app = FastAPI()
+
+
+# Define the route listing a page the way it was done before the fast path
+@baseline_app.get("/api/v2/users/locations", response_model=schemas.LocationList)
+async def baseline_user_locations(
+    request: Request, current_user: routes.user_dependency, db: routes.db_dependency
+):
+    locations = (
+        await db.scalars(
+            select(models.Location)
+            .where(models.Location.user_id == current_user["id"])
+            .order_by(desc(models.Location.timestamp), models.Location.id)
+            .limit(PAGE_SIZE)
+        )
+    ).all()
+    return {"locations": locations, "pages": 1, "next_cursor": None}
+
+
+# Define a function to create the tables and a user with a few pages of locations
+async def seed(rows: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(models.User),
+            [{"id": 1, "username": "benchuser", "location_count": rows}],
+        )
+        start = datetime.utcnow()
+        await conn.execute(
+            insert(models.Location),
+            [
+                {
+                    "user_id": 1,
+                    "city": "Birmingham",
+                    "country": "United Kingdom",
+                    "latitude": 52.48,
+                    "longitude": -1.89,
+                    "temperature": 283.15,
+                    "description": "Light rain, so bring an umbrella and a coat.",
+                    "timestamp": start - timedelta(minutes=i),
+                }
+                for i in range(rows)
+            ],
+        )
+
+
+async def override_get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+# Define a function to measure the CPU time and wall time per request
+def time_requests(client: TestClient, headers: dict, requests: int) -> tuple:
+    path = f"/api/v2/users/locations?limit={PAGE_SIZE}"
+    client.get(path, headers=headers)
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    return (
+        (time.process_time() - cpu) / requests,
+        (time.perf_counter() - wall) / requests,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(seed(PAGE_SIZE * 3))
+    for target in (app, baseline_app):
+        target.dependency_overrides[routes.get_db] = override_get_db
+    routes.limiter.enabled = False
+    token = routes.create_access_token("benchuser", 1, timedelta(minutes=30))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Check both routes list the same page before timing them
+    with TestClient(app) as fast, TestClient(baseline_app) as baseline:
+        path = f"/api/v2/users/locations?limit={PAGE_SIZE}"
+        fast_page = fast.get(path, headers=headers).json()["locations"]
+        baseline_page = baseline.get(path, headers=headers).json()["locations"]
+        assert fast_page == baseline_page, "the routes list different pages"
+
+        # Alternate between the routes and keep the best round of each
+        results = {}
+        for _ in range(args.rounds):
+            for label, client in (("baseline", baseline), ("fast path", fast)):
+                timing = time_requests(client, headers, args.requests)
+                results[label] = min(results.get(label, timing), timing)
+
+    asyncio.run(engine.dispose())
+
+    print(f"{PAGE_SIZE}-row pages{'cpu':>14}{'wall':>14}")
+    for label, (cpu, wall) in results.items():
+        print(f"{label:14}{cpu * 1e3:>12.3f}ms{wall * 1e3:>12.3f}ms")
+    saving = 1 - results["fast path"][0] / results["baseline"][0]
+    print(f"CPU per request reduced by {saving:.0%}")
+
+
+if __name__ == "__main__":
+    main()
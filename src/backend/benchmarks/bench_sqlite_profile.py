@@ -0,0 +1,92 @@
+"""Compare concurrent write throughput with and without the SQLite storage profile.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_sqlite_profile`.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import event, insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import models
+from app.database import Base, apply_storage_profile, pool_options
+
+
+# Define a function to build an engine on a fresh database file
+async def make_engine(path: str, profile: bool):
+    if profile:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{path}",
+            connect_args={"check_same_thread": False},
+            poolclass=AsyncAdaptedQueuePool,
+            **pool_options(),
+        )
+        event.listen(engine.sync_engine, "connect", apply_storage_profile)
+    else:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{path}", connect_args={"check_same_thread": False}
+        )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(models.User),
+            [{"id": i, "username": f"user{i}", "credits": 10**9} for i in range(100)],
+        )
+    return engine
+
+
+# Define a function to run one writer, mirroring the writes of a location add
+async def writer(SessionLocal, user_id: int, writes: int, errors: list):
+    for _ in range(writes):
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(models.User)
+                    .where(models.User.id == user_id)
+                    .values(credits=models.User.credits - 400)
+                )
+                db.add(models.Location(city="Birmingham", user_id=user_id))
+                await db.commit()
+        except OperationalError as e:
+            errors.append(e)
+
+
+# Define a function to measure write throughput for one configuration
+async def run(profile: bool, writers: int, writes: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = await make_engine(os.path.join(directory, "bench.db"), profile)
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+        errors = []
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(writer(SessionLocal, i % 100, writes, errors) for i in range(writers))
+        )
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+    committed = writers * writes - len(errors)
+    return {"writes/s": committed / elapsed, "seconds": elapsed, "errors": len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{'':10}{'writes/s':>12}{'seconds':>10}{'errors':>8}")
+    for label, profile in (("default", False), ("profile", True)):
+        result = asyncio.run(run(profile, args.writers, args.writes))
+        print(
+            f"{label:10}{result['writes/s']:>12.1f}"
+            f"{result['seconds']:>10.2f}{result['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Measure cold start and fail when it regresses against a baseline commit.
+
+The backend as of `--baseline` (main by default) is extracted with git archive
+and both trees are timed on this machine, alternating between them so they
+share whatever else the machine is doing. Each run starts a fresh interpreter
+twice per tree: once under `python -X importtime` to time importing app.main,
+and once to import the app, run its startup and answer one request, timed from
+process launch to the response. The fastest run of each is compared, as it is
+the least affected by other load, and the command exits with status 1 if the
+working copy is more than `--tolerance` slower than the baseline at either.
+
+Both trees run with the current interpreter and packages, and in temporary
+directories, so the database created at startup does not touch the working copy.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_startup`.
+"""
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Define the script answering one request, which reports when the response arrived
+FIRST_REQUEST = """
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+with TestClient(app) as client:
+    client.get("/api/v2/users/locations")
+    print("ready", flush=True)
+"""
+
+
+# Define a function to extract the backend as of a git ref into a directory
+def extract(ref: str, directory: str) -> str:
+    toplevel, prefix = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel", "--show-prefix"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+    archive = subprocess.run(
+        ["git", "archive", "--format=tar", f"{ref}:{prefix}"],
+        cwd=toplevel,
+        capture_output=True,
+        check=True,
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory, filter="data")
+    return directory
+
+
+# Define a function to get the environment of processes running a backend tree
+def child_env(backend_dir: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [backend_dir, env.get("PYTHONPATH")])
+    )
+    return env
+
+
+# Define a function to time importing app.main, in milliseconds
+def time_import(backend_dir: str, directory: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=directory,
+        env=child_env(backend_dir),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "app.main":
+            return int(fields[1]) / 1e3
+    raise RuntimeError("app.main was not found in the import times")
+
+
+# Define a function to time launching the app until its first response, in milliseconds
+def time_first_request(backend_dir: str, directory: str) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", FIRST_REQUEST],
+        cwd=directory,
+        env=child_env(backend_dir),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = process.stdout.readline()
+    elapsed = (time.perf_counter() - start) * 1e3
+    process.wait()
+    if line.strip() != "ready":
+        raise RuntimeError("the app did not answer its first request")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--baseline", default="main", help="git ref to compare with")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    measures = {"import_ms": time_import, "first_request_ms": time_first_request}
+    timings = {
+        tree: {name: [] for name in measures} for tree in ("baseline", "current")
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        trees = {
+            "baseline": extract(args.baseline, os.path.join(directory, "baseline")),
+            "current": BACKEND_DIR,
+        }
+        for tree, backend_dir in trees.items():
+            workdir = os.path.join(directory, f"{tree}-run")
+            os.makedirs(workdir)
+            trees[tree] = (backend_dir, workdir)
+
+        # Start with one untimed run of each, so both trees have their bytecode
+        for run in range(args.runs + 1):
+            for name, measure in measures.items():
+                for tree, (backend_dir, workdir) in trees.items():
+                    elapsed = measure(backend_dir, workdir)
+                    if run:
+                        timings[tree][name].append(elapsed)
+    fastest = {
+        tree: {name: min(values) for name, values in measured.items()}
+        for tree, measured in timings.items()
+    }
+
+    failed = False
+    print(f"Compared with {args.baseline}")
+    print(f"{'':18}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name in measures:
+        before, after = fastest["baseline"][name], fastest["current"][name]
+        ratio = after / before
+        verdict = "ok" if ratio <= 1 + args.tolerance else "REGRESSED"
+        failed = failed or verdict != "ok"
+        print(
+            f"{name:18}{before:>10.1f}ms{after:>10.1f}ms"
+            f"{100 * (ratio - 1):>+9.1f}%  {verdict}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
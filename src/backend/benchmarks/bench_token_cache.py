@@ -0,0 +1,102 @@
+"""Measure the per-request saving from the verified token cache.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_token_cache`.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app import models, routes
+from app.cache import TTLCache
+from app.database import Base
+from app.main import app
+
+ENDPOINTS = ["/api/v2/credits", "/api/v2/users/locations"]
+
+engine = create_async_engine(
+    "sqlite+aiosqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+# Define a function to create the tables and the benchmark user
+async def seed():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        db.add(models.User(id=1, username="benchuser", email="bench@example.com"))
+        await db.commit()
+
+
+async def override_get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+# Define a function to build a client backed by a seeded in-memory database
+def make_client() -> tuple[TestClient, str]:
+    asyncio.run(seed())
+    app.dependency_overrides[routes.get_db] = override_get_db
+    routes.limiter.enabled = False
+    token = routes.create_access_token("benchuser", 1, timedelta(minutes=30))
+    return TestClient(app), token
+
+
+# Define a function to time requests to an endpoint
+def time_endpoint(client: TestClient, token: str, path: str, requests: int) -> float:
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get(path, headers=headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    return (time.perf_counter() - start) / requests
+
+
+# Define a function to time token decoding on its own
+def time_decode(token: str, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        routes.decode_token(token)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # Alternate between cached and uncached runs and keep the best of each
+    client, token = make_client()
+    results = {"uncached": {}, "cached": {}}
+    with client:
+        for _ in range(args.rounds):
+            for label, size in (("uncached", 0), ("cached", 4096)):
+                routes._token_cache = TTLCache(size, routes.ACCESS_TOKEN_EXPIRE * 60)
+                timings = {"decode": time_decode(token, args.requests)}
+                for path in ENDPOINTS:
+                    timings[path] = time_endpoint(client, token, path, args.requests)
+                for name, timing in timings.items():
+                    results[label][name] = min(results[label].get(name, timing), timing)
+
+    asyncio.run(engine.dispose())
+
+    print(f"{'':28}{'uncached':>12}{'cached':>12}{'saving':>12}")
+    for name in ["decode", *ENDPOINTS]:
+        uncached = results["uncached"][name] * 1e6
+        cached = results["cached"][name] * 1e6
+        print(
+            f"{name:28}{uncached:>10.1f}us{cached:>10.1f}us{uncached - cached:>10.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
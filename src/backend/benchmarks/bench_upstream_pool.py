@@ -0,0 +1,149 @@
+"""Compare upstream calls on a new connection each time with the shared pooled client.
+
+A local HTTPS server stands in for an upstream. `--rtt` adds a simulated
+network round trip to each response, and two more to each new connection for
+the TCP and TLS handshakes, so the numbers reflect a provider that is not on
+the same machine. The baseline opens a client per call, the way upstream calls
+were made before the shared client; the pooled run uses upstream.get_http_client.
+
+Run from src/backend with `poetry run python -m benchmarks.bench_upstream_pool`.
+"""
+
+import argparse
+import asyncio
+import datetime
+import ssl
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from app import upstream
+
+BODY = b'{"main": {"temp": 283.15}, "weather": [{"description": "light rain"}]}'
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+    + f"content-length: {len(BODY)}\r\n\r\n".encode()
+    + BODY
+)
+
+
+# Define a function to write a self-signed certificate for localhost
+def write_certificate(directory: Path) -> tuple:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False
+        )
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = directory / "cert.pem", directory / "key.pem"
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return cert_path, key_path
+
+
+# Define a function to serve the same weather response to every request
+async def start_server(cert_path: Path, key_path: Path, rtt: float):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+
+    async def handle(reader, writer):
+        await asyncio.sleep(2 * rtt)
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                await asyncio.sleep(rtt)
+                writer.write(RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "localhost", 0, ssl=context)
+
+
+# Define a function to time calls made with the given function, concurrency at a time
+async def time_calls(call, calls: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await call()
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return (time.perf_counter() - start) / calls * concurrency
+
+
+async def run(args) -> tuple:
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = write_certificate(Path(directory))
+        server = await start_server(cert_path, key_path, args.rtt)
+        port = server.sockets[0].getsockname()[1]
+        url = f"https://localhost:{port}/data/2.5/weather"
+        verify = ssl.create_default_context(cafile=str(cert_path))
+
+        async def new_connection():
+            async with httpx.AsyncClient(verify=verify) as client:
+                return await client.get(url)
+
+        upstream._http_client = httpx.AsyncClient(
+            verify=verify, limits=upstream.get_limits()
+        )
+
+        async def pooled():
+            return await upstream.get_http_client().get(url)
+
+        results = {}
+        for label, call in (("new connection", new_connection), ("pooled", pooled)):
+            await call()
+            results[label] = await time_calls(call, args.calls, args.concurrency)
+        stats = upstream.pool_stats()
+
+        await upstream.close_clients()
+        server.close()
+        await server.wait_closed()
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rtt", type=float, default=0.02)
+    args = parser.parse_args()
+
+    results, stats = asyncio.run(run(args))
+
+    print(f"{'':16}{'per call':>12}")
+    for label, seconds in results.items():
+        print(f"{label:16}{seconds * 1e3:>10.2f}ms")
+    saving = 1 - results["pooled"] / results["new connection"]
+    print(f"Time per call reduced by {saving:.0%}")
+    print(f"Pool held {stats['connections']} connections, {stats['idle']} idle")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Local stand-ins for ipdata, OpenWeather and OpenAI with configurable latency."""
+
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+
+import httpx
+
+from app import upstream
+
+# Define the cities the fake geolocation service places callers in
+CITIES = [
+    ("Birmingham", "United Kingdom", 52.48, -1.89),
+    ("Manchester", "United Kingdom", 53.48, -2.24),
+    ("Paris", "France", 48.86, 2.35),
+    ("Berlin", "Germany", 52.52, 13.40),
+    ("Madrid", "Spain", 40.42, -3.70),
+    ("Rome", "Italy", 41.90, 12.50),
+    ("Oslo", "Norway", 59.91, 10.75),
+    ("Lisbon", "Portugal", 38.72, -9.14),
+]
+DESCRIPTIONS = ["clear sky", "light rain", "overcast clouds", "snow", "mist"]
+
+
+# Define the fake upstream services
+class FakeUpstreams:
+    def __init__(self, latency: dict, locations: int = 100, seed: int = 0):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.locations = [self._location(i) for i in range(locations)]
+        self.calls = {"ipdata": 0, "openweather": 0, "openai": 0}
+
+    # Define a function to make up a location near one of the known cities
+    def _location(self, index: int) -> dict:
+        city, country, latitude, longitude = CITIES[index % len(CITIES)]
+        return {
+            "city": city if index < len(CITIES) else f"{city} {index}",
+            "country_name": country,
+            "latitude": latitude + self.random.uniform(-2, 2),
+            "longitude": longitude + self.random.uniform(-2, 2),
+        }
+
+    # Define a function to make up the weather at some coordinates
+    def _weather(self, latitude: float, longitude: float) -> dict:
+        return {
+            "coord": {"lat": latitude, "lon": longitude},
+            "main": {"temp": 263.15 + (latitude * 7 + longitude) % 35},
+            "weather": [{"description": DESCRIPTIONS[int(latitude + longitude) % 5]}],
+        }
+
+    # Define a function to answer a request to one of the upstreams
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == "api.ipdata.co":
+            service, body = "ipdata", self.random.choice(self.locations)
+        elif host == "api.openweathermap.org":
+            service = "openweather"
+            params = request.url.params
+            if "q" in params:
+                index = zlib.crc32(params["q"].encode()) % len(self.locations)
+                location = self.locations[index]
+                body = self._weather(location["latitude"], location["longitude"])
+            else:
+                body = self._weather(float(params["lat"]), float(params["lon"]))
+        elif host == "api.openai.com":
+            service = "openai"
+            payload = json.loads(request.content)
+            prompt = payload["messages"][0]["content"]
+            if payload.get("stream"):
+                self.calls[service] += 1
+                return httpx.Response(
+                    200,
+                    headers={"content-type": "text/event-stream"},
+                    content=self._completion_events(prompt),
+                )
+            body = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-3.5-turbo",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": prompt.split(": ", 1)[-1]
+                            + " Wear something warm.",
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        else:
+            return httpx.Response(404)
+        self.calls[service] += 1
+        await asyncio.sleep(self.latency.get(service, 0))
+        return httpx.Response(200, json=body)
+
+    # Define a function to stream a completion a word at a time, spread over the latency
+    async def _completion_events(self, prompt: str):
+        words = (prompt.split(": ", 1)[-1] + " Wear something warm.").split(" ")
+        delay = self.latency.get("openai", 0) / len(words)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "gpt-3.5-turbo",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    # Define a function to route the shared upstream clients to the fakes
+    def install(self):
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        upstream._http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(self.handle)
+        )
+        upstream._openai_client = None
@@ -0,0 +1,387 @@
+"""Drive every API route with concurrent clients and record latency and throughput.
+
+The upstream services are replaced by local fakes that add configurable latency.
+Each database size is seeded into a fresh SQLite file using the app's storage
+profile. Results are written as JSON so runs can be compared across commits.
+
+Run from src/backend with `poetry run python -m benchmarks.suite`, and pass
+`--baseline` with an earlier results file to print the change per route.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import advice, hashing, jobs, models, routes, upstream
+from app.database import Base, apply_storage_profile, pool_options
+from app.main import app
+from benchmarks.fakes import FakeUpstreams
+
+PASSWORD = "benchpass"
+
+# Define the seeded users, each used by the routes that change or remove it
+READER_ID = 1
+RENAMED_ID = 2
+PRUNED_ID = 3
+DELETED_ID_START = 1000
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# Define a function to seed a database file with users and locations
+def seed(path: str, size: int, capacity: int, hashed_password: str):
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", apply_storage_profile)
+    Base.metadata.create_all(engine)
+    users = [
+        {"id": READER_ID, "username": "benchuser", "location_count": size},
+        {"id": RENAMED_ID, "username": "renameuser", "location_count": 0},
+        {"id": PRUNED_ID, "username": "pruneuser", "location_count": capacity},
+    ]
+    users += [
+        {"id": DELETED_ID_START + i, "username": f"deleteuser{i}", "location_count": 0}
+        for i in range(capacity)
+    ]
+    for user in users:
+        user.update(
+            email=f"{user['username']}@example.com",
+            hashed_password=hashed_password,
+            credits=10**9,
+        )
+    start = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), users)
+        for owner, count in ((READER_ID, size), (PRUNED_ID, capacity)):
+            for offset in range(0, count, 10000):
+                conn.execute(
+                    insert(models.Location),
+                    [
+                        {
+                            "user_id": owner,
+                            "city": "Birmingham",
+                            "country": "United Kingdom",
+                            "latitude": 52.48,
+                            "longitude": -1.89,
+                            "temperature": 283.15,
+                            "description": "Light rain, so bring an umbrella.",
+                            "timestamp": start - timedelta(minutes=i),
+                        }
+                        for i in range(offset, min(offset + 10000, count))
+                    ],
+                )
+
+            # Keep the statistics the app maintains alongside the locations
+            if count:
+                conn.execute(
+                    insert(models.LocationStat),
+                    {
+                        "user_id": owner,
+                        "city": "Birmingham",
+                        "country": "United Kingdom",
+                        "samples": count,
+                        "temperature_sum": 283.15 * count,
+                        "min_temperature": 283.15,
+                        "max_temperature": 283.15,
+                        "last_seen": start,
+                    },
+                )
+    engine.dispose()
+
+
+# Define a function to build the requests made for each route
+def route_calls(tokens: dict, pruned_ids: list, cursor: str, job_id: int) -> dict:
+    def auth(user_id: int) -> dict:
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    reader = auth(READER_ID)
+    cities = [{"city": f"City {i}", "country": "Benchland"} for i in range(5)]
+    return {
+        "register": lambda client, i: client.post(
+            "/api/v2/users/register",
+            json={
+                "username": f"newuser{i}",
+                "email": f"newuser{i}@example.com",
+                "password": PASSWORD,
+            },
+        ),
+        "login": lambda client, i: client.post(
+            "/api/v2/users/login",
+            data={"username": "benchuser", "password": PASSWORD},
+        ),
+        "get_profile": lambda client, i: client.get(
+            "/api/v2/users/profile", headers=reader
+        ),
+        "update_profile": lambda client, i: client.put(
+            "/api/v2/users/profile",
+            json={"username": f"renamed{i}"},
+            headers=auth(RENAMED_ID),
+        ),
+        "delete_profile": lambda client, i: client.delete(
+            "/api/v2/users/profile", headers=auth(DELETED_ID_START + i)
+        ),
+        "get_credits": lambda client, i: client.get("/api/v2/credits", headers=reader),
+        "purchase_credits": lambda client, i: client.post(
+            "/api/v2/credits/purchase?amount=1", headers=reader
+        ),
+        "list_locations": lambda client, i: client.get(
+            "/api/v2/users/locations", headers=reader
+        ),
+        "list_locations_cursor": lambda client, i: client.get(
+            "/api/v2/users/locations",
+            params={"after": cursor, "include_total": "false"} if cursor else {},
+            headers=reader,
+        ),
+        "add_location": lambda client, i: client.post(
+            "/api/v2/users/locations", headers=reader
+        ),
+        "add_location_stream": lambda client, i: client.post(
+            "/api/v2/users/locations/stream", headers=reader
+        ),
+        "queue_location": lambda client, i: client.post(
+            "/api/v2/users/locations/jobs", headers=reader
+        ),
+        "get_location_job": lambda client, i: client.get(
+            f"/api/v2/users/locations/jobs/{job_id}", headers=reader
+        ),
+        "add_locations_batch": lambda client, i: client.post(
+            "/api/v2/users/locations/batch", json=cities, headers=reader
+        ),
+        "location_stats": lambda client, i: client.get(
+            "/api/v2/users/locations/stats", headers=reader
+        ),
+        "location_history": lambda client, i: client.get(
+            "/api/v2/users/locations/history", headers=reader
+        ),
+        "export_locations": lambda client, i: client.get(
+            "/api/v2/users/locations/export", headers=reader
+        ),
+        "delete_location": lambda client, i: client.delete(
+            f"/api/v2/users/locations/{pruned_ids[i]}", headers=auth(PRUNED_ID)
+        ),
+    }
+
+
+# Define a function to summarise the latencies of one route
+def summarise(latencies: list, errors: int, elapsed: float) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+# Define a function to run requests against a route from concurrent clients
+async def drive(client, call, start: int, requests: int, concurrency: int) -> dict:
+    indices = iter(range(start, start + requests))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for i in indices:
+            began = time.perf_counter()
+            response = await call(client, i)
+            latencies.append(time.perf_counter() - began)
+            if response.status_code >= 400:
+                errors += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(latencies, errors, time.perf_counter() - began)
+
+
+# Define a function to benchmark every route against one database size
+async def run_size(args, size: int, hashed_password: str, directory: str) -> dict:
+    capacity = args.warmup + args.requests
+    path = os.path.join(directory, f"bench-{size}.db")
+    seed(path, size, capacity, hashed_password)
+
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        poolclass=AsyncAdaptedQueuePool,
+        **pool_options(),
+    )
+    event.listen(engine.sync_engine, "connect", apply_storage_profile)
+    SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    app.dependency_overrides[routes.get_session_factory] = lambda: SessionLocal
+
+    # Start every size with cold caches and fresh fakes
+    for cache in (
+        routes.get_token_cache(),
+        upstream.get_weather_cache(),
+        advice.get_advice_cache(),
+    ):
+        cache.clear()
+    FakeUpstreams(args.latency, args.distinct_locations).install()
+    jobs.start(SessionLocal)
+
+    tokens = {
+        user_id: routes.create_access_token(
+            f"user{user_id}", user_id, timedelta(hours=1)
+        )
+        for user_id in (READER_ID, RENAMED_ID, PRUNED_ID)
+    }
+    tokens.update(
+        (
+            DELETED_ID_START + i,
+            routes.create_access_token("u", DELETED_ID_START + i, timedelta(hours=1)),
+        )
+        for i in range(capacity)
+    )
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        async with SessionLocal() as db:
+            pruned_ids = list(
+                await db.scalars(
+                    select(models.Location.id)
+                    .where(models.Location.user_id == PRUNED_ID)
+                    .order_by(models.Location.id)
+                )
+            )
+        first_page = await client.get(
+            "/api/v2/users/locations",
+            headers={"Authorization": f"Bearer {tokens[READER_ID]}"},
+        )
+        cursor = first_page.json()["next_cursor"]
+        queued = await client.post(
+            "/api/v2/users/locations/jobs",
+            headers={"Authorization": f"Bearer {tokens[READER_ID]}"},
+        )
+
+        calls = route_calls(tokens, pruned_ids, cursor, queued.json()["job_id"])
+        for name in args.routes or calls:
+            call = calls[name]
+            for i in range(args.warmup):
+                await call(client, i)
+            results[name] = await drive(
+                client, call, args.warmup, args.requests, args.concurrency
+            )
+            print(
+                f"{size:>8} {name:24}{results[name]['rps']:>10.1f} rps"
+                f"{results[name]['p50_ms']:>10.2f}{results[name]['p95_ms']:>10.2f}"
+                f"{results[name]['p99_ms']:>10.2f} ms  errors {results[name]['errors']}"
+            )
+
+    await jobs.stop()
+    await upstream.close_clients()
+    await engine.dispose()
+    app.dependency_overrides.pop(routes.get_session_factory, None)
+    return results
+
+
+# Define a function to get the commit being benchmarked
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Define a function to print the change from a baseline results file
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange from {baseline['commit']} ({baseline_path})")
+    for size, routes_run in results["results"].items():
+        for name, stats in routes_run.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if before is None:
+                continue
+            changes = [
+                f"{key} {100 * (stats[key] - before[key]) / before[key]:+.1f}%"
+                for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+                if before[key]
+            ]
+            print(f"{size:>8} {name:24}{'  '.join(changes)}")
+
+
+async def run(args) -> dict:
+    routes.limiter.enabled = False
+    hashed_password = await hashing.hash_password(PASSWORD)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rows':>8} {'route':24}{'':>14}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for size in args.sizes:
+            results[str(size)] = await run_size(args, size, hashed_password, directory)
+    hashing.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[0, 1000, 10000],
+        help="comma separated numbers of locations to seed for the reading user",
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--routes", nargs="*", help="only benchmark these routes")
+    parser.add_argument("--ipdata-latency", type=float, default=0.05)
+    parser.add_argument("--openweather-latency", type=float, default=0.08)
+    parser.add_argument("--openai-latency", type=float, default=0.6)
+    parser.add_argument("--distinct-locations", type=int, default=100)
+    parser.add_argument("--output", help="results file, by default under results/")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+    args.latency = {
+        "ipdata": args.ipdata_latency,
+        "openweather": args.openweather_latency,
+        "openai": args.openai_latency,
+    }
+
+    commit = current_commit()
+    results = {
+        "commit": commit,
+        "created": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            key: value for key, value in vars(args).items() if key != "baseline"
+        },
+        "results": asyncio.run(run(args)),
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
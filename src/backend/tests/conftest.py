@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import Base, apply_storage_profile
+
+
+# Provide a function to run a test against a file database holding the given rows
+#
+# The database gets the app's storage profile and tables, then each model's
+# rows in the order given. The test is called with a session factory and its
+# result returned once the engine has been disposed of.
+@pytest.fixture
+def run_with_rows(tmp_path):
+    def run(test, rows: dict):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+        event.listen(engine.sync_engine, "connect", apply_storage_profile)
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def run_test():
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                for model, model_rows in rows.items():
+                    await conn.execute(insert(model), model_rows)
+            try:
+                return await test(SessionLocal)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(run_test())
+
+    return run
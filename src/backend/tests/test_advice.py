@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app import advice, models, upstream
+from app.database import Base
+
+engine = create_async_engine(
+    "sqlite+aiosqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+
+TestingSessionLocal = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False
+)
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+asyncio.run(create_tables())
+
+
+# Close the database connection once the module's tests have run
+@pytest.fixture(scope="module", autouse=True)
+def dispose_engine():
+    yield
+    asyncio.run(engine.dispose())
+
+
+# Advice template round trip test
+def test_advice_template_round_trip():
+    sentence = advice.weather_sentence("Birmingham", "United Kingdom", 283.15, "rain")
+    text = f"{sentence} In Birmingham, United Kingdom, pack a $5 umbrella."
+    template = advice.to_template(text, sentence)
+
+    # Verify that only the weather sentence was replaced by a placeholder
+    assert template.startswith("${weather} In Birmingham")
+
+    # Verify that rendering for another city rebuilds the sentence and keeps the rest
+    assert advice.render(
+        template, "Coventry", "United Kingdom", 283.65, "rain"
+    ) == advice.weather_sentence("Coventry", "United Kingdom", 283.65, "rain") + (
+        " In Birmingham, United Kingdom, pack a $5 umbrella."
+    )
+
+
+# Advice template for a city named after its country test
+def test_advice_template_city_named_after_country():
+    sentence = advice.weather_sentence("Singapore", "Singapore", 303.15, "sun")
+    template = advice.to_template(f"{sentence} Wear linen.", sentence)
+
+    # Verify that the country is not repeated when rendering for another city
+    assert advice.render(template, "London", "United Kingdom", 303.15, "sun") == (
+        advice.weather_sentence("London", "United Kingdom", 303.15, "sun")
+        + " Wear linen."
+    )
+
+
+# Advice template for a city that is also a word test
+def test_advice_template_city_that_is_a_word():
+    sentence = advice.weather_sentence("Nice", "France", 298.15, "sun")
+    template = advice.to_template(f"{sentence} A Nice day for a T-shirt!", sentence)
+    rendered = advice.render(template, "Leeds", "United Kingdom", 298.15, "sun")
+
+    # Verify that the advice after the weather sentence is left as written
+    assert rendered.startswith("The weather in Leeds, United Kingdom")
+    assert rendered.endswith(" A Nice day for a T-shirt!")
+
+
+# Advice template without the weather sentence test
+def test_advice_template_for_bare_continuation():
+    sentence = advice.weather_sentence("Leeds", "United Kingdom", 283.15, "rain")
+    template = advice.to_template("Wear a coat.", sentence)
+
+    # Verify that the weather sentence is put in front of the continuation
+    assert advice.render(template, "York", "United Kingdom", 283.15, "rain") == (
+        advice.weather_sentence("York", "United Kingdom", 283.15, "rain")
+        + " Wear a coat."
+    )
+
+
+# Advice reuse for similar weather test
+def test_advice_reused_for_similar_weather(monkeypatch):
+    prompts = []
+
+    async def fake_complete_weather_info(weather_info, locale=None):
+        prompts.append(weather_info)
+        return f"{weather_info} Wear a coat."
+
+    monkeypatch.setattr(upstream, "complete_weather_info", fake_complete_weather_info)
+    advice.get_advice_cache().clear()
+
+    async def get_advice_for_cities():
+        async with TestingSessionLocal() as db:
+            first = await advice.get_weather_advice(
+                db, "Birmingham", "United Kingdom", 283.65, "Light rain"
+            )
+            second = await advice.get_weather_advice(
+                db, "Leeds", "United Kingdom", 283.75, "light rain"
+            )
+
+            # Record the memory hit against the stored template
+            await advice._flush_touches(db)
+            stored_advice = await db.scalar(select(models.WeatherAdvice))
+            await db.refresh(stored_advice)
+            touched = stored_advice.last_used_at > stored_advice.created_at
+
+            # Verify that the advice survives the in-memory cache being cleared
+            advice.get_advice_cache().clear()
+            await advice.get_weather_advice(
+                db, "York", "United Kingdom", 283.5, "light rain"
+            )
+            stored = await db.scalar(select(func.count(models.WeatherAdvice.id)))
+
+            # Verify that a different locale gets its own completion
+            await advice.get_weather_advice(
+                db, "Paris", "France", 283.5, "light rain", locale="fr-FR"
+            )
+            return first, second, stored, touched
+
+    first, second, stored, touched = asyncio.run(get_advice_for_cities())
+
+    # Verify that similar weather reused the first completion
+    assert first.startswith("The weather in Birmingham, United Kingdom")
+    assert second.startswith("The weather in Leeds, United Kingdom")
+    assert second.endswith("Wear a coat.")
+    assert stored == 1
+
+    # Verify that memory hits keep the stored template recently used
+    assert touched
+
+    # Verify that only the first city and the new locale reached the AI
+    assert len(prompts) == 2
+    assert "Paris" in prompts[1]
@@ -0,0 +1,102 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from jose import JWTError
+
+from app import routes, upstream
+from app.cache import TTLCache
+
+
+# Default cache hit and miss test
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache(maxsize=2, ttl=60)
+
+    # Verify that a missing key counts as a miss
+    assert cache.get("a") is None
+    cache.set("a", 1)
+
+    # Verify that a stored key counts as a hit
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+# Cache expiry test
+def test_ttl_cache_expiry():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0)
+
+    # Verify that an expired entry is dropped
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+# Cache LRU eviction test
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    # Verify that the least recently used entry was evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+# Weather cache grid test
+def test_weather_cache_shares_grid_cell(monkeypatch):
+    calls = []
+
+    async def fake_fetch_weather(latitude, longitude):
+        calls.append((latitude, longitude))
+        await asyncio.sleep(0.01)
+        return {"temperature": 283.15, "description": "light rain"}
+
+    monkeypatch.setattr(upstream, "fetch_weather", fake_fetch_weather)
+    upstream.get_weather_cache().clear()
+
+    async def fetch_all():
+        return await asyncio.gather(
+            upstream.get_weather(52.4812, -1.8904),
+            upstream.get_weather(52.4795, -1.8911),
+            upstream.get_weather(52.4801, -1.8899),
+        )
+
+    results = asyncio.run(fetch_all())
+
+    # Verify that nearby coordinates were served by a single upstream call
+    assert len(calls) == 1
+    assert all(result["description"] == "light rain" for result in results)
+
+    # Verify that a later lookup in the same cell is a cache hit
+    asyncio.run(upstream.get_weather(52.4807, -1.8902))
+    assert len(calls) == 1
+    assert upstream.get_weather_cache().stats()["hits"] == 1
+
+
+# Verified token cache test
+def test_token_cache(monkeypatch):
+    decoded = []
+    decode = routes.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(routes.jwt, "decode", counting_decode)
+    token = routes.create_access_token("testuser", 1, timedelta(minutes=30))
+    routes.decode_token(token)
+    payload = routes.decode_token(token)
+
+    # Verify that the token signature was only checked once
+    assert payload["sub"] == "testuser"
+    assert decoded == [token]
+
+    # Verify that expired tokens are rejected and not cached
+    expired = routes.create_access_token("testuser", 1, timedelta(seconds=-1))
+    with pytest.raises(JWTError):
+        routes.decode_token(expired)
+    assert routes.get_token_cache().get(expired) is None
@@ -0,0 +1,67 @@
+import asyncio
+
+from app import credits, models
+
+
+# Define a function to run concurrent credit updates against a file database
+def run_concurrently(run_with_rows, starting_credits, operations):
+    async def test(SessionLocal):
+        async def run_operation(operation, amount):
+            async with SessionLocal() as db:
+                return await operation(db, 1, amount)
+
+        results = await asyncio.gather(
+            *(run_operation(operation, amount) for operation, amount in operations)
+        )
+        async with SessionLocal() as db:
+            balance = (await db.get(models.User, 1)).credits
+        return results, balance
+
+    return run_with_rows(
+        test,
+        {
+            models.User: [
+                {
+                    "id": 1,
+                    "username": "testuser",
+                    "email": "testuser@example.com",
+                    "hashed_password": "x",
+                    "credits": starting_credits,
+                }
+            ]
+        },
+    )
+
+
+# Concurrent credit reservation test
+def test_concurrent_reservations_never_overspend(run_with_rows):
+    results, balance = run_concurrently(
+        run_with_rows, 10000, [(credits.reserve_credits, 400)] * 100
+    )
+
+    # Verify that exactly as many reservations succeeded as the balance covered
+    assert results.count(True) == 25
+    assert balance == 0
+
+
+# Concurrent reservation and purchase test
+def test_concurrent_reservations_and_purchases_lose_no_updates(run_with_rows):
+    operations = [(credits.reserve_credits, 400)] * 50
+    operations += [(credits.add_credits, 100)] * 50
+    results, balance = run_concurrently(run_with_rows, 20000, operations)
+
+    # Verify that every purchase and every successful reservation was applied
+    reserved = results[:50].count(True)
+    assert all(results[50:])
+    assert balance == 20000 - 400 * reserved + 100 * 50
+    assert balance >= 0
+
+
+# Credit refund test
+def test_refund_returns_reserved_credits(run_with_rows):
+    results, balance = run_concurrently(
+        run_with_rows, 0, [(credits.refund_credits, 400)] * 3
+    )
+
+    # Verify that every refund was added back to the balance
+    assert balance == 1200
@@ -0,0 +1,78 @@
+from dataclasses import replace
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from app import deletion, models
+from app.config import get_settings
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    settings = replace(get_settings(), deletion_chunk_size=10, deletion_pause=0)
+    monkeypatch.setattr(deletion, "get_settings", lambda: settings)
+
+
+# Define users with locations, the first with several chunks of them
+ROWS = {
+    models.User: [{"id": i, "username": f"user{i}"} for i in (1, 2)],
+    models.Location: [{"user_id": 1}] * 25 + [{"user_id": 2}] * 3,
+}
+
+
+# Define a function to count each user's remaining locations
+async def count_locations(db) -> dict:
+    rows = await db.execute(
+        select(models.Location.user_id, func.count()).group_by(models.Location.user_id)
+    )
+    return dict(rows.all())
+
+
+# Chunked purge test
+def test_purge_removes_deleted_user_in_chunks(run_with_rows, monkeypatch):
+    chunks = []
+    delete_chunk = deletion._delete_chunk
+
+    async def counting_delete_chunk(db, user_id, chunk_size):
+        chunks.append(chunk_size)
+        return await delete_chunk(db, user_id, chunk_size)
+
+    monkeypatch.setattr(deletion, "_delete_chunk", counting_delete_chunk)
+
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            tombstoned = await deletion.tombstone(db, 1)
+            purged = await deletion.run_once(SessionLocal)
+            idle = await deletion.run_once(SessionLocal)
+            user = await db.get(models.User, 1)
+            return tombstoned, purged, idle, user, await count_locations(db)
+
+    tombstoned, purged, idle, user, counts = run_with_rows(test, ROWS)
+
+    # Verify that the user was purged over several chunks, leaving others alone
+    assert tombstoned and purged and not idle
+    assert chunks == [10, 10, 10]
+    assert user is None
+    assert counts == {2: 3}
+
+
+# Tombstone test
+def test_tombstone_unknown_or_deleted_user(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            return [await deletion.tombstone(db, user_id) for user_id in (1, 1, 9)]
+
+    # Verify that only a live user can be deleted
+    assert run_with_rows(test, ROWS) == [True, False, False]
+
+
+# Cascading delete test
+def test_deleting_user_cascades_to_locations(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            await db.execute(delete(models.User).where(models.User.id == 1))
+            await db.commit()
+            return await count_locations(db)
+
+    # Verify that the foreign key removes the user's locations with them
+    assert run_with_rows(test, ROWS) == {2: 3}
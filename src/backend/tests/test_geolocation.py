@@ -0,0 +1,98 @@
+import asyncio
+from dataclasses import replace
+
+import pytest
+from fastapi import Request
+
+from app import geolocation, upstream
+from app.config import get_settings
+
+BIRMINGHAM = {
+    "latitude": 52.48,
+    "longitude": -1.89,
+    "city": "Birmingham",
+    "country": "United Kingdom",
+}
+
+
+@pytest.fixture(autouse=True)
+def trusted_proxies(monkeypatch):
+    settings = replace(get_settings(), trusted_proxies=("10.0.0.0/8",))
+    monkeypatch.setattr(geolocation, "get_settings", lambda: settings)
+    geolocation.get_location_cache().clear()
+
+
+# Define a function to fake ipdata, recording the addresses looked up
+@pytest.fixture
+def lookups(monkeypatch) -> list:
+    calls = []
+
+    async def fake_lookup_location(ip=None):
+        calls.append(ip)
+        return BIRMINGHAM
+
+    monkeypatch.setattr(upstream, "lookup_location", fake_lookup_location)
+    return calls
+
+
+# Define a function to build a request from a peer with the given headers
+def make_request(peer: str, forwarded_for: str = None) -> Request:
+    headers = []
+    if forwarded_for is not None:
+        headers.append((b"x-forwarded-for", forwarded_for.encode()))
+    return Request({"type": "http", "client": (peer, 50000), "headers": headers})
+
+
+# Untrusted forwarded header test
+def test_client_ip_ignores_header_from_untrusted_peer():
+    request = make_request("81.2.69.160", "203.0.113.7")
+
+    # Verify that a client cannot choose its address by sending the header
+    assert geolocation.client_ip(request) == "81.2.69.160"
+
+
+# Trusted proxy test
+def test_client_ip_reads_header_behind_trusted_proxies():
+    request = make_request("10.0.0.2", "203.0.113.7, 81.2.69.160, 10.0.0.1")
+
+    # Verify that trusted hops are skipped and earlier entries are not believed
+    assert geolocation.client_ip(request) == "81.2.69.160"
+
+
+# Geolocation cache test
+def test_locate_shares_lookups_within_network(lookups):
+    async def run():
+        for ip in ("81.2.69.160", "81.2.69.5", "81.2.70.1"):
+            await geolocation.locate(ip)
+
+    asyncio.run(run())
+
+    # Verify that addresses in the same /24 share one ipdata lookup
+    assert lookups == ["81.2.69.160", "81.2.70.1"]
+
+
+# Private address geolocation test
+def test_locate_private_address_uses_server_address(lookups):
+    asyncio.run(geolocation.locate("192.168.1.20"))
+
+    # Verify that private addresses are located by the server's public address
+    assert lookups == [None]
+
+
+# Offline database test
+def test_locate_checks_offline_database_first(monkeypatch, lookups):
+    class FakeReader:
+        def get(self, ip):
+            return {
+                "location": {"latitude": 51.45, "longitude": -2.59},
+                "city": {"names": {"en": "Bristol"}},
+                "country": {"names": {"en": "United Kingdom"}},
+            }
+
+    monkeypatch.setattr(geolocation, "get_reader", lambda: FakeReader())
+
+    location = asyncio.run(geolocation.locate("81.2.69.160"))
+
+    # Verify that the offline database answers without calling ipdata
+    assert location["city"] == "Bristol"
+    assert lookups == []
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from app import hashing
+from app.config import get_settings
+
+
+# Default hash and verify test
+def test_hash_and_verify_password():
+    async def hash_and_verify():
+        hashed_password = await hashing.hash_password("testpassword")
+        return (
+            await hashing.verify_password("testpassword", hashed_password),
+            await hashing.verify_password("wrongpassword", hashed_password),
+        )
+
+    # Verify that only the original password matches the hash
+    assert asyncio.run(hash_and_verify()) == (True, False)
+
+
+# Saturated hashing pool test
+def test_hashing_pool_busy(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(
+        hashing, "_in_flight", settings.hash_pool_size + settings.hash_queue_depth
+    )
+
+    # Verify that new jobs are refused once the queue is full
+    with pytest.raises(hashing.HashingPoolBusy):
+        asyncio.run(hashing.hash_password("testpassword"))
+
+    # Verify that clients are told when to retry
+    response = hashing.hashing_pool_busy_handler(None, hashing.HashingPoolBusy())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(settings.hash_retry_after)
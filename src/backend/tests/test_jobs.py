@@ -0,0 +1,206 @@
+import asyncio
+import shutil
+import tempfile
+from dataclasses import replace
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import delete, event, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import advice, geolocation, jobs, models, upstream
+from app.config import get_settings
+from app.database import Base, apply_storage_profile
+
+# Use a file database so each worker gets its own connection and transaction
+database_dir = Path(tempfile.mkdtemp())
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{database_dir / 'jobs.db'}",
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=0,
+)
+event.listen(engine.sync_engine, "connect", apply_storage_profile)
+
+TestingSessionLocal = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False
+)
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with TestingSessionLocal() as db:
+        db.add(models.User(id=1, username="jobuser", email="job@example.com"))
+        await db.commit()
+
+
+asyncio.run(create_tables())
+
+
+# Close the database connection once the module's tests have run
+@pytest.fixture(scope="module", autouse=True)
+def dispose_engine():
+    yield
+    asyncio.run(engine.dispose())
+    shutil.rmtree(database_dir)
+
+
+# Stub the upstream services for every test in this module
+@pytest.fixture(autouse=True)
+def fake_upstreams(monkeypatch):
+    async def fake_lookup_location(ip=None):
+        return {
+            "latitude": 51.45,
+            "longitude": -2.59,
+            "city": "Bristol",
+            "country": "United Kingdom",
+        }
+
+    async def fake_fetch_weather(latitude, longitude):
+        return {"temperature": 288.15, "description": "broken clouds"}
+
+    async def fake_complete_weather_info(weather_info, locale=None):
+        return weather_info + " A light jacket will do."
+
+    monkeypatch.setattr(upstream, "lookup_location", fake_lookup_location)
+    monkeypatch.setattr(upstream, "fetch_weather", fake_fetch_weather)
+    monkeypatch.setattr(upstream, "complete_weather_info", fake_complete_weather_info)
+    advice.get_advice_cache().clear()
+    upstream.get_weather_cache().clear()
+    geolocation.get_location_cache().clear()
+
+
+# Define a function to queue a location and return its id
+async def queue():
+    async with TestingSessionLocal() as db:
+        location = jobs.queue_location(1, None)
+        db.add(location)
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == 1)
+            .values(location_count=models.User.location_count + 1)
+        )
+        await db.commit()
+        return location.id
+
+
+# Define a function to load a location
+async def load(location_id: int) -> models.Location:
+    async with TestingSessionLocal() as db:
+        return await db.get(models.Location, location_id)
+
+
+# Queued location fill in test
+def test_run_once_fills_in_location():
+    async def run():
+        location_id = await queue()
+        assert await jobs.run_once(TestingSessionLocal)
+        assert not await jobs.run_once(TestingSessionLocal)
+        return await load(location_id)
+
+    location = asyncio.run(run())
+
+    # Verify that the location was filled in and marked ready
+    assert location.status == "ready"
+    assert location.city == "Bristol"
+    assert location.description.endswith("A light jacket will do.")
+    assert location.attempts == 1
+
+
+# Queued location retry and refund test
+def test_run_once_retries_then_refunds(monkeypatch):
+    async def failing_lookup_location(ip=None):
+        raise RuntimeError("geolocation unavailable")
+
+    monkeypatch.setattr(upstream, "lookup_location", failing_lookup_location)
+    geolocation.get_location_cache().clear()
+
+    async def run():
+        location_id = await queue()
+        async with TestingSessionLocal() as db:
+            count = (await db.get(models.User, 1)).location_count
+        states = []
+        for _ in range(3):
+            assert await jobs.run_once(TestingSessionLocal)
+            location = await load(location_id)
+            states.append(location.status)
+
+            # Make the retry due straight away
+            async with TestingSessionLocal() as db:
+                await db.execute(
+                    update(models.Location)
+                    .where(models.Location.id == location_id)
+                    .where(models.Location.status == "pending")
+                    .values(available_at=datetime.utcnow())
+                )
+                await db.commit()
+        async with TestingSessionLocal() as db:
+            user = await db.get(models.User, 1)
+        return states, user.credits, user.location_count, count
+
+    states, balance, location_count, count = asyncio.run(run())
+
+    # Verify that the location was retried until it ran out of attempts
+    assert states == ["pending", "pending", "failed"]
+
+    # Verify that the reserved credits were given back
+    assert balance == 2000 + 400
+
+    # Verify that the failed location no longer counts towards the user's locations
+    assert location_count == count - 1
+
+
+# Expired lease test
+def test_stale_worker_cannot_finish_reclaimed_location(monkeypatch):
+    monkeypatch.setattr(
+        jobs, "get_settings", lambda: replace(get_settings(), job_lease=0)
+    )
+
+    async def run():
+        location_id = await queue()
+        async with TestingSessionLocal() as db:
+            stale = await jobs._claim(db)
+            fresh = await jobs._claim(db)
+            await jobs._fill_in(db, *stale)
+            await jobs._fail(db, stale[0], stale[1], stale[4])
+            location = await load(location_id)
+
+            # Leave nothing due for the other tests
+            await db.execute(
+                delete(models.Location).where(models.Location.id == location_id)
+            )
+            await db.commit()
+        return stale, fresh, location
+
+    stale, fresh, location = asyncio.run(run())
+
+    # Verify that the location was claimed again once the first lease ran out
+    assert (stale[0], stale[4], fresh[0], fresh[4]) == (location.id, 1, location.id, 2)
+
+    # Verify that the worker that lost its lease wrote nothing
+    assert (location.status, location.city, location.attempts) == ("running", None, 2)
+
+
+# Worker pool test
+def test_workers_fill_in_queued_locations():
+    async def run():
+        jobs.start(TestingSessionLocal)
+        try:
+            location_ids = [await queue() for _ in range(3)]
+            jobs.notify()
+            for _ in range(100):
+                locations = [await load(location_id) for location_id in location_ids]
+                if all(location.status == "ready" for location in locations):
+                    return locations
+                await asyncio.sleep(0.01)
+            return locations
+        finally:
+            await jobs.stop()
+
+    locations = asyncio.run(run())
+
+    # Verify that the workers filled in every queued location
+    assert [location.status for location in locations] == ["ready"] * 3
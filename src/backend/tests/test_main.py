@@ -1,35 +1,58 @@
+import asyncio
+import json
+
+import pytest
 from fastapi import responses
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 
+from app import advice, geolocation, upstream, users
 from app.database import Base
 from app.main import app
-from app.routes import get_db
+from app.routes import get_db, get_session_factory
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-engine = create_engine(
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
 
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False
+)
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+asyncio.run(create_tables())
+
 
-Base.metadata.create_all(bind=engine)
+# Close the database connection once the module's tests have run
+@pytest.fixture(scope="module", autouse=True)
+def dispose_engine():
+    # User ids restart with every test database, so drop rows cached by others
+    users.get_user_cache().clear()
+    yield
+    asyncio.run(engine.dispose())
 
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def override_get_session_factory():
+    return TestingSessionLocal
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_session_factory] = override_get_session_factory
 
 client = TestClient(app)
 
@@ -283,8 +306,28 @@ def test_get_user_locations():
     assert len(response.json()) >= 0
 
 
+# Invalid cursor get user locations test
+def test_bad_cursor_get_user_locations():
+    # Make a GET request with a malformed cursor
+    response = client.get(
+        "/api/v2/users/locations?after=notacursor",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 422 UNPROCESSABLE ENTITY
+    assert response.status_code == 422
+
+    # Verify that the response body contains the expected message
+    assert response.json()["detail"] == "Invalid cursor."
+
+
 # Default add user location test
 def test_new_user_location():
+    # Forget results cached by other test modules, so the real upstreams are called
+    advice.get_advice_cache().clear()
+    upstream.get_weather_cache().clear()
+    geolocation.get_location_cache().clear()
+
     # Make a POST request to add a new user location
     response = client.post(
         "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
@@ -297,6 +340,129 @@ def test_new_user_location():
     assert "message" in response.json()
 
 
+# Stubbed upstreams add user location test
+def test_new_user_location_with_upstreams(monkeypatch):
+    async def fake_lookup_location(ip=None):
+        return {
+            "latitude": 52.48,
+            "longitude": -1.89,
+            "city": "Birmingham",
+            "country": "United Kingdom",
+        }
+
+    async def fake_fetch_weather(latitude, longitude):
+        return {"temperature": 283.15, "description": "light rain"}
+
+    async def fake_complete_weather_info(weather_info, locale=None):
+        return weather_info + " Bring an umbrella."
+
+    monkeypatch.setattr(upstream, "lookup_location", fake_lookup_location)
+    monkeypatch.setattr(upstream, "fetch_weather", fake_fetch_weather)
+    monkeypatch.setattr(upstream, "complete_weather_info", fake_complete_weather_info)
+    advice.get_advice_cache().clear()
+    upstream.get_weather_cache().clear()
+    geolocation.get_location_cache().clear()
+
+    # Make a POST request to add a new user location
+    response = client.post(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that the response body contains the expected message
+    assert response.json()["message"] == "Location added successfully"
+
+    # Verify that the location was stored with the AI message
+    response = client.get(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    location = response.json()["locations"][0]
+    assert location["city"] == "Birmingham"
+    assert location["description"].endswith("Bring an umbrella.")
+    assert response.json()["pages"] == 1
+
+    # Verify that the location cost was taken from the user's credits
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 1850
+
+
+# Failed upstream add user location test
+def test_new_user_location_refunds_credits(monkeypatch):
+    async def failing_lookup_location(ip=None):
+        raise RuntimeError("geolocation unavailable")
+
+    monkeypatch.setattr(upstream, "lookup_location", failing_lookup_location)
+    geolocation.get_location_cache().clear()
+
+    # Make a POST request to add a new user location
+    response = client.post(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+
+    # Verify that the response body contains the expected message
+    assert response.json()["message"] == "Failed to retrieve user's location"
+
+    # Verify that the reserved credits were refunded
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 1850
+
+
+# Get user locations without totals test
+def test_get_user_locations_without_total():
+    # Make a GET request to get the user's locations without the page count
+    response = client.get(
+        "/api/v2/users/locations?include_total=false",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that the locations are listed without a page count
+    assert len(response.json()["locations"]) == 1
+    assert response.json()["pages"] is None
+
+
+# Get user location history test
+def test_get_user_location_history():
+    # Make a GET request to get the user's daily history
+    response = client.get(
+        "/api/v2/users/locations/history",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that today's location is summarised
+    (day,) = response.json()["days"]
+    assert day["samples"] == 1
+    assert day["min_temperature"] == day["max_temperature"] == day["avg_temperature"]
+
+
+# Get user location statistics test
+def test_get_user_location_stats():
+    # Make a GET request to get the user's statistics by city
+    response = client.get(
+        "/api/v2/users/locations/stats",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that the saved location is counted
+    (city,) = response.json()["cities"]
+    assert city["samples"] == 1
+    assert city["last_seen"] is not None
+
+
 def test_delete_user_location():
     # Make a DELETE request to delete a user location
     response = client.delete(
@@ -308,3 +474,311 @@ def test_delete_user_location():
 
     # Verify that the response body contains the expected keys
     assert "message" in response.json()
+
+    # Verify that the maintained location count was decremented
+    response = client.get(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["pages"] == 0
+
+    # Verify that the deleted location left the statistics
+    response = client.get(
+        "/api/v2/users/locations/stats",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+    assert response.json()["cities"] == []
+
+
+# Batch add user locations test
+def test_new_user_locations_batch(monkeypatch):
+    async def fake_fetch_city_weather(city, country):
+        if city == "Atlantis":
+            raise RuntimeError("city not found")
+        return {
+            "latitude": 52.41,
+            "longitude": -1.51,
+            "temperature": 284.15,
+            "description": "overcast clouds",
+        }
+
+    async def fake_complete_weather_info(weather_info, locale=None):
+        return weather_info + " Wear a jumper."
+
+    monkeypatch.setattr(upstream, "fetch_city_weather", fake_fetch_city_weather)
+    monkeypatch.setattr(upstream, "complete_weather_info", fake_complete_weather_info)
+    upstream.get_weather_cache().clear()
+
+    # Make a POST request to add two locations in one batch
+    response = client.post(
+        "/api/v2/users/locations/batch",
+        headers={"Authorization": f"Bearer {login_token}"},
+        json=[
+            {"city": "Coventry", "country": "United Kingdom"},
+            {"city": "Atlantis", "country": "Nowhere"},
+        ],
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that each location reports its own outcome
+    results = response.json()["results"]
+    assert response.json()["message"] == "1 of 2 locations added successfully"
+    assert [result["added"] for result in results] == [True, False]
+    assert results[1]["message"] == "Failed to retrieve weather data"
+
+    # Verify that the stored location has the AI message
+    response = client.get(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    location = response.json()["locations"][0]
+    assert location["city"] == "Coventry"
+    assert location["description"].endswith("Wear a jumper.")
+    assert response.json()["pages"] == 1
+
+    # Verify that only the added location was paid for
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 1450
+
+
+# Oversized batch add user locations test
+def test_oversized_user_locations_batch():
+    # Make a POST request with no locations
+    response = client.post(
+        "/api/v2/users/locations/batch",
+        headers={"Authorization": f"Bearer {login_token}"},
+        json=[],
+    )
+
+    # Verify that the response status code is 422 Unprocessable Entity
+    assert response.status_code == 422
+
+
+# Export user locations test
+def test_export_user_locations():
+    # Make a GET request to export the user's locations as NDJSON
+    response = client.get(
+        "/api/v2/users/locations/export",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that each location is written as one JSON line
+    lines = response.text.splitlines()
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(lines) == 1
+    assert json.loads(lines[0])["city"] == "Coventry"
+
+    # Verify that the CSV export has a header and one row
+    response = client.get(
+        "/api/v2/users/locations/export?format=csv",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,city,country")
+    assert len(lines) == 2
+
+    # Verify that locations before the since filter are left out
+    response = client.get(
+        "/api/v2/users/locations/export?since=2999-01-01T00:00:00",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+    assert response.text == ""
+
+
+# Bad format export user locations test
+def test_bad_format_export_user_locations():
+    # Make a GET request for an unknown export format
+    response = client.get(
+        "/api/v2/users/locations/export?format=xml",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 422 Unprocessable Entity
+    assert response.status_code == 422
+
+
+# Streaming add user location test
+def test_stream_user_location(monkeypatch):
+    async def fake_lookup_location(ip=None):
+        return {
+            "latitude": 55.95,
+            "longitude": -3.19,
+            "city": "Edinburgh",
+            "country": "United Kingdom",
+        }
+
+    async def fake_fetch_weather(latitude, longitude):
+        return {"temperature": 270.15, "description": "snow"}
+
+    async def fake_stream_weather_info(weather_info, locale=None):
+        for chunk in [weather_info, " Wear", " boots."]:
+            yield chunk
+
+    monkeypatch.setattr(upstream, "lookup_location", fake_lookup_location)
+    monkeypatch.setattr(upstream, "fetch_weather", fake_fetch_weather)
+    monkeypatch.setattr(upstream, "stream_weather_info", fake_stream_weather_info)
+    advice.get_advice_cache().clear()
+    upstream.get_weather_cache().clear()
+
+    # Make a POST request to add a location with streamed advice
+    response = client.post(
+        "/api/v2/users/locations/stream",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response is an event stream
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    # Verify that the weather comes first, then the advice, then the outcome
+    events = [
+        (lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: ")))
+        for lines in (
+            block.split("\n") for block in response.text.strip().split("\n\n")
+        )
+    ]
+    assert [event for event, _ in events] == [
+        "weather",
+        "advice",
+        "advice",
+        "advice",
+        "done",
+    ]
+    assert events[0][1]["city"] == "Edinburgh"
+
+    # Verify that the assembled advice was stored with the location
+    response = client.get(
+        "/api/v2/users/locations", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    location = response.json()["locations"][0]
+    assert location["city"] == "Edinburgh"
+    assert location["description"].endswith("Wear boots.")
+
+    # Verify that the location cost was taken from the user's credits
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 1050
+
+
+# Stream closed before it starts test
+def test_stream_user_location_closed_before_start(monkeypatch):
+    async def fake_lookup_location(ip=None):
+        return {
+            "latitude": 55.95,
+            "longitude": -3.19,
+            "city": "Edinburgh",
+            "country": "United Kingdom",
+        }
+
+    async def fake_fetch_weather(latitude, longitude):
+        return {"temperature": 270.15, "description": "snow"}
+
+    monkeypatch.setattr(upstream, "lookup_location", fake_lookup_location)
+    monkeypatch.setattr(upstream, "fetch_weather", fake_fetch_weather)
+    upstream.get_weather_cache().clear()
+
+    # Call the app directly, with a client that is gone before the headers arrive
+    messages = iter([{"type": "http.request", "body": b"", "more_body": False}])
+
+    async def receive():
+        return next(messages, {"type": "http.disconnect"})
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("Connection reset by peer")
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/v2/users/locations/stream",
+        "raw_path": b"/api/v2/users/locations/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"authorization", f"Bearer {login_token}".encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    with pytest.raises((OSError, ExceptionGroup)):
+        asyncio.run(app(scope, receive, send))
+
+    # Verify that the reserved credits were refunded although the stream never ran
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 1050
+
+
+# Queue user location test
+def test_queue_user_location():
+    # Make a POST request to queue a location
+    response = client.post(
+        "/api/v2/users/locations/jobs",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 202 Accepted
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    # Verify that the job reports that it is waiting for a worker
+    response = client.get(
+        f"/api/v2/users/locations/jobs/{job_id}",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "pending"
+    assert response.json()["location"] is None
+
+    # Verify that the location cost was reserved
+    response = client.get(
+        "/api/v2/credits", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.json()["credits"] == 650
+
+
+# Unknown job test
+def test_get_unknown_user_location_job():
+    # Make a GET request for a job that does not exist
+    response = client.get(
+        "/api/v2/users/locations/jobs/9999",
+        headers={"Authorization": f"Bearer {login_token}"},
+    )
+
+    # Verify that the response status code is 404 Not Found
+    assert response.status_code == 404
+
+
+# Delete user profile test
+def test_delete_user_profile():
+    # Make a DELETE request to delete the user's profile
+    response = client.delete(
+        "/api/v2/users/profile", headers={"Authorization": f"Bearer {login_token}"}
+    )
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that the user's token stops working at once
+    response = client.get(
+        "/api/v2/users/profile", headers={"Authorization": f"Bearer {login_token}"}
+    )
+    assert response.status_code == 401
+
+    # Verify that the user can no longer log in
+    response = client.post(
+        "/api/v2/users/login",
+        data={
+            "username": default_user_data["username"],
+            "password": default_user_data["password"],
+        },
+    )
+    assert response.status_code == 401
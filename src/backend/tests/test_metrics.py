@@ -0,0 +1,74 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app import metrics
+from app.main import app
+
+client = TestClient(app)
+
+
+# Histogram rendering test
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        "test_seconds", "Test timings.", ("name",), (0.1, 1.0)
+    )
+    metrics._registry.remove(histogram)
+    histogram.observe(0.05, name="a")
+    histogram.observe(5, name="a")
+    lines = histogram.render()
+
+    # Verify that buckets are cumulative and the overflow only counts towards +Inf
+    assert 'test_seconds_bucket{name="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{name="a",le="1.0"} 1' in lines
+    assert 'test_seconds_bucket{name="a",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{name="a"} 2' in lines
+
+
+# Database query timing test
+def test_instrument_engine_times_queries():
+    engine = create_engine("sqlite:///:memory:")
+    metrics.instrument_engine(engine)
+
+    def count(outcome: str) -> int:
+        timed = metrics.DB_QUERY_DURATION.get(operation="SELECT", outcome=outcome)
+        return (timed or {"count": 0})["count"]
+
+    before = count("ok"), count("error")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing"))
+        starts = conn.info["query_start"]
+    engine.dispose()
+
+    # Verify that each statement was counted by its operation and outcome
+    assert (count("ok"), count("error")) == (before[0] + 1, before[1] + 1)
+
+    # Verify that the failed statement's start time was not left behind
+    assert starts == []
+
+
+# Metrics endpoint test
+def test_metrics_endpoint():
+    # Make a request that is refused before it reaches the database
+    client.get(
+        "/api/v2/users/locations/export", headers={"Authorization": "Bearer bad"}
+    )
+
+    # Make a GET request for the metrics
+    response = client.get("/metrics")
+
+    # Verify that the response status code is 200 OK
+    assert response.status_code == 200
+
+    # Verify that the request was timed under its route template
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/api/v2/users/locations/export",status="401"} 1' in response.text
+    )
+
+    # Verify that the threadpool queue depth is reported
+    assert "threadpool_queue_depth " in response.text
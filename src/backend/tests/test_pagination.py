@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, desc
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models, pagination
+from app.database import Base
+
+engine = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+# Cursor round trip test
+def test_cursor_round_trip():
+    location = models.Location(id=42, timestamp=datetime(2024, 4, 11, 9, 30))
+    cursor = pagination.encode_cursor(location)
+
+    # Verify that the cursor decodes to the same position
+    assert pagination.decode_cursor(cursor) == (datetime(2024, 4, 11, 9, 30), 42)
+
+
+# Invalid cursor test
+def test_invalid_cursor():
+    # Verify that malformed cursors are rejected
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor("notacursor")
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(pagination.encode_cursor(models.Location()))
+
+
+# Cursor walk test
+def test_cursor_walk_matches_offset_order():
+    db = TestingSessionLocal()
+    days = (None, 1, 2, 2, None, 2, 3, 4, 4)
+    db.add_all(
+        [
+            models.Location(user_id=1, city=str(day), timestamp=datetime(2024, 4, 1))
+            for day in days
+        ]
+        + [models.Location(user_id=2, city="other", timestamp=datetime(2024, 4, 2))]
+    )
+    db.commit()
+
+    # Give each row its timestamp, leaving legacy rows without one
+    for location in db.query(models.Location).filter(models.Location.user_id == 1):
+        day = int(location.city) if location.city != "None" else None
+        location.timestamp = day and datetime(2024, 4, day)
+    db.commit()
+
+    query = (
+        db.query(models.Location)
+        .filter(models.Location.user_id == 1)
+        .order_by(desc(models.Location.timestamp), models.Location.id)
+    )
+    expected = [location.id for location in query.all()]
+
+    # Verify that rows without a timestamp were stored as such
+    assert sum(location.timestamp is None for location in query.all()) == 2
+
+    # Walk the history two rows at a time using cursors
+    seen = []
+    page = query.limit(2).all()
+    while page:
+        seen.extend(location.id for location in page)
+        cursor = pagination.encode_cursor(page[-1])
+        page = query.filter(pagination.after_cursor(cursor)).limit(2).all()
+
+    # Verify that every location was visited once, in the same order as offsets
+    assert seen == expected
+    db.close()
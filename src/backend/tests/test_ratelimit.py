@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import multiprocessing
+import socketserver
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from limits import parse
+from limits.storage import RedisStorage, storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from slowapi.errors import RateLimitExceeded
+from starlette.requests import Request
+
+from app import ratelimit, routes
+
+
+# Define a function to hit a shared rate limit from a worker process
+def hit_limit(uri: str, hits: int) -> int:
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    limit = parse("50/minute")
+    return sum(limiter.hit(limit, "user:1") for _ in range(hits))
+
+
+# Define a stand-in for a Redis server, speaking just enough of its protocol
+#
+# Counters are kept in one dictionary behind a lock, and the one script the
+# fixed window limit runs is carried out here rather than interpreted as Lua.
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RedisStandInHandler)
+        self.values = {}
+        self.lock = threading.Lock()
+        self.scripts = {
+            hashlib.sha1(RedisStorage.SCRIPT_INCR_EXPIRE).hexdigest(): "incr"
+        }
+
+    # Define a function to get a key's value and expiry time, forgetting it once expired
+    def lookup(self, key: bytes):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            del self.values[key]
+            return None, None
+        return value, expires
+
+    # Define a function to run one command, returning its reply
+    def execute(self, command: bytes, args: list):
+        with self.lock:
+            if command == b"PING":
+                return "PONG"
+            if command in (b"CLIENT", b"SELECT"):
+                return "OK"
+            if command == b"SCRIPT":
+                digest = hashlib.sha1(args[1]).hexdigest()
+                self.scripts.setdefault(digest, None)
+                return digest.encode()
+            if command == b"EVALSHA":
+                if self.scripts.get(args[0].decode()) != "incr":
+                    return RuntimeError("NOSCRIPT No matching script.")
+                key, expiry, amount = args[2], int(args[3]), int(args[4])
+                value, expires = self.lookup(key)
+                value = (value or 0) + amount
+                if value == amount:
+                    expires = time.time() + expiry
+                self.values[key] = (value, expires)
+                return value
+            if command == b"GET":
+                value, _ = self.lookup(args[0])
+                return None if value is None else str(value).encode()
+            if command == b"TTL":
+                value, expires = self.lookup(args[0])
+                return -2 if value is None else int(expires - time.time())
+            if command == b"DEL":
+                return sum(self.values.pop(key, None) is not None for key in args)
+            return RuntimeError(f"ERR unknown command {command.decode()}")
+
+
+# Define a handler reading commands from one Redis client connection
+class RedisStandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            reply = self.server.execute(args[0].upper(), args[1:])
+            if isinstance(reply, RuntimeError):
+                self.wfile.write(f"-{reply}\r\n".encode())
+            elif isinstance(reply, str):
+                self.wfile.write(f"+{reply}\r\n".encode())
+            elif isinstance(reply, int):
+                self.wfile.write(f":{reply}\r\n".encode())
+            elif reply is None:
+                self.wfile.write(b"$-1\r\n")
+            else:
+                self.wfile.write(b"$%d\r\n%s\r\n" % (len(reply), reply))
+
+
+# Start a Redis stand-in for a test, returning its URI
+@pytest.fixture
+def redis_uri():
+    pytest.importorskip("redis")
+    server = RedisStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+# Define a function to build a request with the given headers
+def make_request(headers: dict) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("203.0.113.7", 50000),
+        }
+    )
+
+
+# Shared SQLite rate limit storage test
+def test_sqlite_storage_counts_window():
+    storage = storage_from_string("sqlite:///:memory:")
+
+    # Verify that the URI scheme is served by the SQLite storage
+    assert isinstance(storage, ratelimit.SQLiteStorage)
+    assert storage.check()
+
+    # Verify that hits accumulate within a window and restart once it expires
+    assert storage.incr("key", 60) == 1
+    assert storage.incr("key", 60, amount=2) == 3
+    assert storage.get("key") == 3
+    assert storage.incr("expired", 0) == 1
+    assert storage.incr("expired", 60) == 1
+    storage.clear("key")
+    assert storage.get("key") == 0
+
+
+# Rate limit across worker processes test
+def test_sqlite_storage_exact_across_processes(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'ratelimits.db'}"
+    storage_from_string(uri)
+    with ProcessPoolExecutor(
+        max_workers=4, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        allowed = sum(executor.map(hit_limit, [uri] * 4, [40] * 4))
+
+    # Verify that exactly the limit was allowed across all workers
+    assert allowed == 50
+
+
+# Shared Redis rate limit storage test
+def test_redis_storage_exact_across_clients(redis_uri):
+    storage = storage_from_string(redis_uri)
+
+    # Verify that the URI scheme is served by the Redis storage
+    assert isinstance(storage, RedisStorage)
+    assert storage.check()
+
+    # Verify that hits accumulate within a window
+    assert storage.incr("key", 60) == 1
+    assert storage.incr("key", 60, amount=2) == 3
+    assert storage.get("key") == 3
+    assert storage.get_expiry("key") > time.time()
+
+    # Verify that exactly the limit was allowed across clients hitting it at once
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        allowed = sum(executor.map(hit_limit, [redis_uri] * 4, [40] * 4))
+    assert allowed == 50
+
+
+# Rate limit check off the event loop test
+def test_limits_checked_off_event_loop(tmp_path, monkeypatch):
+    threads = []
+    incr = ratelimit.SQLiteStorage.incr
+
+    def recording_incr(self, *args, **kwargs):
+        threads.append(threading.get_ident())
+        return incr(self, *args, **kwargs)
+
+    monkeypatch.setattr(ratelimit.SQLiteStorage, "incr", recording_incr)
+    limiter = ratelimit.Limiter(
+        key_func=lambda request: "user:1",
+        storage_uri=f"sqlite:///{tmp_path / 'ratelimits.db'}",
+    )
+
+    @limiter.limit("1/minute")
+    async def endpoint(request: Request):
+        return threading.get_ident()
+
+    async def call_twice():
+        first, second = make_request({}), make_request({})
+        first.scope["path"] = second.scope["path"] = "/endpoint"
+        served = await endpoint(request=first)
+        with pytest.raises(RateLimitExceeded):
+            await endpoint(request=second)
+        return served
+
+    loop_thread = asyncio.run(call_twice())
+
+    # Verify that the counter was written for both calls, outside the event loop
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+# Rate limit key test
+def test_rate_limit_key():
+    token = routes.create_access_token("testuser", 7, timedelta(minutes=30))
+
+    # Verify that authenticated requests are keyed by user
+    assert (
+        routes.rate_limit_key(make_request({"Authorization": f"Bearer {token}"}))
+        == "user:7"
+    )
+
+    # Verify that anonymous and invalid requests are keyed by address
+    assert routes.rate_limit_key(make_request({})) == "ip:203.0.113.7"
+    assert (
+        routes.rate_limit_key(make_request({"Authorization": "Bearer bad"}))
+        == "ip:203.0.113.7"
+    )
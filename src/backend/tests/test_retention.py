@@ -0,0 +1,147 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import models, retention
+from app.config import get_settings
+
+NOW = datetime.utcnow()
+OLD = datetime(NOW.year, NOW.month, NOW.day, 12) - timedelta(days=40)
+
+# Define locations spread over two old days and today, for two users
+LOCATIONS = [
+    {"user_id": 1, "city": "Leeds", "temperature": 10.0, "timestamp": OLD},
+    {"user_id": 1, "city": "Leeds", "temperature": 14.0, "timestamp": OLD},
+    {"user_id": 1, "city": "York", "temperature": 9.0, "timestamp": OLD},
+    {"user_id": 1, "city": "Leeds", "temperature": 6.0, "timestamp": OLD},
+    {
+        "user_id": 1,
+        "city": "Leeds",
+        "temperature": 8.0,
+        "timestamp": OLD - timedelta(days=1),
+    },
+    {"user_id": 1, "status": "failed", "timestamp": OLD},
+    {"user_id": 1, "status": "pending", "timestamp": OLD},
+    {"user_id": 1, "city": "Leeds", "temperature": 20.0, "timestamp": NOW},
+    {"user_id": 2, "city": "Leeds", "temperature": 30.0, "timestamp": OLD},
+]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    settings = replace(
+        get_settings(), retention_days=30, retention_batch_size=2, retention_pause=0
+    )
+    monkeypatch.setattr(retention, "get_settings", lambda: settings)
+
+
+# Define the users owning the locations, with their maintained location counts
+ROWS = {
+    models.User: [
+        {"id": 1, "username": "user1", "location_count": 7},
+        {"id": 2, "username": "user2", "location_count": 1},
+    ],
+    models.Location: [
+        {"status": "ready", "city": None, "temperature": None, **location}
+        for location in LOCATIONS
+    ],
+}
+
+
+# Define a function to read a user's merged history as plain rows
+async def read_history(db, user_id: int, since=None, until=None) -> list:
+    rows = await db.execute(retention.history(user_id, since, until))
+    return [row._asdict() for row in rows]
+
+
+# Compaction test
+def test_compaction_folds_old_locations_into_rollups(run_with_rows):
+    async def test(SessionLocal):
+        removed = await retention.run_once(SessionLocal)
+        async with SessionLocal() as db:
+            statuses = (
+                await db.scalars(select(models.Location.status).order_by("id"))
+            ).all()
+            rollup = (
+                await db.scalars(
+                    select(models.LocationRollup).where(
+                        models.LocationRollup.user_id == 1,
+                        models.LocationRollup.city == "Leeds",
+                        models.LocationRollup.day == OLD.date(),
+                    )
+                )
+            ).one()
+            counts = (
+                await db.execute(
+                    select(models.User.id, models.User.location_count).order_by("id")
+                )
+            ).all()
+            return removed, statuses, rollup, counts
+
+    removed, statuses, rollup, counts = run_with_rows(test, ROWS)
+
+    # Verify that old rows were removed, keeping recent and unfinished ones
+    assert removed == 7
+    assert statuses == ["pending", "ready"]
+
+    # Verify that the rollup holds the day's aggregates across batches
+    assert (rollup.min_temperature, rollup.max_temperature) == (6.0, 14.0)
+    assert rollup.avg_temperature == pytest.approx(10.0)
+    assert rollup.samples == 3
+
+    # Verify that the maintained location counts match the rows left
+    assert counts == [(1, 2), (2, 0)]
+
+
+# Merged history test
+def test_history_is_unchanged_by_compaction(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            before = await read_history(db, 1)
+            await retention.run_once(SessionLocal)
+            after = await read_history(db, 1)
+            window = await read_history(db, 1, since=OLD.date(), until=OLD.date())
+            return before, after, window
+
+    before, after, window = run_with_rows(test, ROWS)
+
+    # Verify that compacted days read the same as they did from the raw rows
+    assert after == before
+    assert [(row["day"], row["city"], row["samples"]) for row in after] == [
+        (NOW.date(), "Leeds", 1),
+        (OLD.date(), "Leeds", 3),
+        (OLD.date(), "York", 1),
+        (OLD.date() - timedelta(days=1), "Leeds", 1),
+    ]
+
+    # Verify that the history can be limited to a range of days
+    assert {row["day"] for row in window} == {OLD.date()}
+
+
+# Split day history test
+def test_history_merges_day_split_between_raw_and_rollups(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            db.add(
+                models.LocationRollup(
+                    user_id=1,
+                    day=NOW.date(),
+                    city="Leeds",
+                    country="",
+                    min_temperature=0.0,
+                    max_temperature=4.0,
+                    avg_temperature=2.0,
+                    samples=3,
+                )
+            )
+            await db.commit()
+            return await read_history(db, 1, since=NOW.date())
+
+    (today,) = run_with_rows(test, ROWS)
+
+    # Verify that rolled up and raw samples of one day are combined
+    assert (today["min_temperature"], today["max_temperature"]) == (0.0, 20.0)
+    assert today["avg_temperature"] == pytest.approx(6.5)
+    assert today["samples"] == 4
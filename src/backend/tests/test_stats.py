@@ -0,0 +1,124 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import models, retention, stats
+from app.config import get_settings
+
+NOW = datetime.utcnow().replace(microsecond=0)
+
+# Define locations saved by two users, some of them long ago
+LOCATIONS = [
+    {"user_id": 1, "city": "Leeds", "temperature": 10.0, "days_ago": 40},
+    {"user_id": 1, "city": "Leeds", "temperature": 4.0, "days_ago": 2},
+    {"user_id": 1, "city": "Leeds", "temperature": 13.0, "days_ago": 1},
+    {"user_id": 1, "city": "York", "temperature": 9.0, "days_ago": 0},
+    {"user_id": 2, "city": "Leeds", "temperature": 30.0, "days_ago": 0},
+]
+
+
+# Define the saved locations as rows
+ROWS = [
+    {
+        "user_id": location["user_id"],
+        "city": location["city"],
+        "country": "United Kingdom",
+        "temperature": location["temperature"],
+        "timestamp": NOW - timedelta(days=location["days_ago"]),
+    }
+    for location in LOCATIONS
+]
+
+
+# Define a function to run a test against a database whose locations were recorded
+def run_with_locations(run_with_rows, test):
+    async def recorded(SessionLocal):
+        async with SessionLocal() as db:
+            await stats.record(db, ROWS)
+            await db.commit()
+        return await test(SessionLocal)
+
+    return run_with_rows(
+        recorded,
+        {
+            models.User: [{"id": i, "username": f"user{i}"} for i in (1, 2)],
+            models.Location: ROWS,
+        },
+    )
+
+
+# Define a function to read a user's statistics as plain rows
+async def read_stats(db, user_id: int) -> list:
+    return [row._asdict() for row in await db.execute(stats.summary(user_id))]
+
+
+# Recorded statistics test
+def test_record_keeps_per_city_statistics(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            return await read_stats(db, 1)
+
+    leeds, york = run_with_locations(run_with_rows, test)
+
+    # Verify that each city's count, average, extremes and last visit are kept
+    assert (leeds["city"], leeds["samples"]) == ("Leeds", 3)
+    assert leeds["avg_temperature"] == pytest.approx(9.0)
+    assert (leeds["min_temperature"], leeds["max_temperature"]) == (4.0, 13.0)
+    assert leeds["last_seen"] == NOW - timedelta(days=1)
+    assert (york["city"], york["samples"]) == ("York", 1)
+
+
+# Forgotten location test
+def test_forget_matches_totalling_again(run_with_rows):
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            results = []
+            for temperature in (10.0, 13.0):
+                location = await db.scalar(
+                    select(models.Location).where(
+                        models.Location.temperature == temperature
+                    )
+                )
+                await db.delete(location)
+                await stats.forget(db, location)
+                await db.commit()
+                incremental = await read_stats(db, 1)
+                await stats._replace(db, 1)
+                await db.commit()
+                results.append((incremental, await read_stats(db, 1)))
+            return results
+
+    results = run_with_locations(run_with_rows, test)
+
+    # Verify that deleting an ordinary and then the latest location both add up
+    for incremental, totalled in results:
+        assert incremental == totalled
+    leeds = results[-1][0][0]
+    assert (leeds["samples"], leeds["max_temperature"]) == (1, 4.0)
+    assert leeds["last_seen"] == NOW - timedelta(days=2)
+
+
+# Backfill test
+def test_backfill_survives_compaction(run_with_rows, monkeypatch):
+    settings = replace(get_settings(), retention_days=30, retention_pause=0)
+    monkeypatch.setattr(retention, "get_settings", lambda: settings)
+
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            recorded = await read_stats(db, 1)
+            await retention.run_once(SessionLocal)
+            await db.execute(models.LocationStat.__table__.delete())
+            await db.commit()
+            users = await stats.backfill(SessionLocal)
+            return recorded, users, await read_stats(db, 1)
+
+    recorded, users, backfilled = run_with_locations(run_with_rows, test)
+
+    # Verify that rebuilding from raw and rolled up locations gives the same counts
+    assert users == 2
+    assert [row["samples"] for row in backfilled] == [3, 1]
+    assert backfilled[0]["avg_temperature"] == pytest.approx(9.0)
+    assert backfilled[0]["min_temperature"] == recorded[0]["min_temperature"]
+    assert backfilled[0]["last_seen"] == recorded[0]["last_seen"]
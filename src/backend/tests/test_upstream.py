@@ -0,0 +1,101 @@
+import asyncio
+from dataclasses import replace
+
+import httpx
+import pytest
+
+from app import upstream
+from app.breaker import CircuitBreaker, CircuitOpen
+from app.config import get_settings
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    settings = replace(
+        get_settings(), upstream_retries=2, upstream_retry_delay=0, breaker_threshold=2
+    )
+    monkeypatch.setattr(upstream, "get_settings", lambda: settings)
+    upstream._breakers.clear()
+    yield
+    upstream._breakers.clear()
+    upstream._http_client = None
+
+
+# Define a function to serve ipdata responses with the given status codes in turn
+def install_ipdata(monkeypatch, statuses: list) -> list:
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if status == "error":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(
+            status,
+            json={
+                "latitude": 52.48,
+                "longitude": -1.89,
+                "city": "Birmingham",
+                "country_name": "United Kingdom",
+            },
+        )
+
+    monkeypatch.setattr(
+        upstream,
+        "_http_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return calls
+
+
+# Upstream retry test
+def test_retries_transient_failures(monkeypatch):
+    calls = install_ipdata(monkeypatch, ["error", 503, 200])
+
+    location = asyncio.run(upstream.lookup_location())
+
+    # Verify that connection errors and 5xx responses are retried until one succeeds
+    assert location["city"] == "Birmingham"
+    assert len(calls) == 3
+    assert upstream.get_breaker("ipdata").state == "closed"
+
+
+# Upstream client error test
+def test_does_not_retry_client_errors(monkeypatch):
+    calls = install_ipdata(monkeypatch, [401])
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.lookup_location())
+
+    # Verify that a 4xx response is not retried and does not count against the breaker
+    assert len(calls) == 1
+    assert upstream.get_breaker("ipdata").failures == 0
+
+
+# Circuit breaker test
+def test_circuit_opens_after_repeated_failures(monkeypatch):
+    calls = install_ipdata(monkeypatch, [503])
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(upstream.lookup_location())
+
+    # Verify that the open circuit fails fast without calling the service
+    with pytest.raises(CircuitOpen):
+        asyncio.run(upstream.lookup_location())
+    assert len(calls) == 6
+    assert upstream.pool_stats()["breakers"]["ipdata"]["state"] == "open"
+
+
+# Circuit breaker recovery test
+def test_circuit_half_opens_for_one_trial():
+    breaker = CircuitBreaker("ipdata", threshold=1, reset_after=0)
+    breaker.record_failure()
+
+    # Verify that a trial call is let through once the reset time has passed
+    assert breaker.state == "half-open"
+    breaker.allow()
+
+    # Verify that a successful trial closes the circuit
+    breaker.record_success()
+    assert breaker.state == "closed"
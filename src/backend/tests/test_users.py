@@ -0,0 +1,67 @@
+from app import models, users
+
+
+# Shared version counter test
+def test_version_counters_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "versions.bin")
+    first = users.VersionCounters(path, 16)
+    second = users.VersionCounters(path, 16)
+
+    first.bump(3)
+    first.bump(3)
+    second.bump(19)
+
+    # Verify that bumps are seen through every mapping and users share slots
+    assert second.get(3) == 3
+    assert first.get(19) == 3
+    assert first.get(4) == 0
+
+    first.close()
+    second.close()
+
+
+# Read-through user cache test
+def test_get_user_reuses_row_until_version_changes(
+    tmp_path, monkeypatch, run_with_rows
+):
+    path = str(tmp_path / "versions.bin")
+    versions = users.VersionCounters(path, 16)
+    other_worker = users.VersionCounters(path, 16)
+    monkeypatch.setattr(users, "get_versions", lambda: versions)
+    users.get_user_cache().clear()
+
+    async def test(SessionLocal):
+        async with SessionLocal() as db:
+            first = await users.get_user(db, 1)
+
+            # Change the row behind the cache's back, as another worker would
+            (await db.get(models.User, 1)).credits = 4
+            await db.commit()
+            stale = await users.get_user(db, 1)
+            other_worker.bump(1)
+            fresh = await users.get_user(db, 1)
+        return first, stale, fresh
+
+    first, stale, fresh = run_with_rows(
+        test,
+        {
+            models.User: [
+                {
+                    "id": 1,
+                    "username": "testuser",
+                    "email": "testuser@example.com",
+                    "hashed_password": "x",
+                    "credits": 10,
+                }
+            ]
+        },
+    )
+    users.get_user_cache().clear()
+
+    # Verify that the row is served from the cache until its version is bumped
+    assert first["credits"] == 10
+    assert stale["credits"] == 10
+    assert fresh["credits"] == 4
+
+    versions.close()
+    other_worker.close()